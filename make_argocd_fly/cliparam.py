@@ -13,6 +13,7 @@ class CLIParams:
     self.source_dir = default.SOURCE_DIR
     self.output_dir = default.OUTPUT_DIR
     self.tmp_dir = default.TMP_DIR
+    self.cache_dir = None
     self.render_apps = None
     self.render_envs = None
     self.skip_generate = False  # TODO: to be deprecated
@@ -27,6 +28,8 @@ class CLIParams:
     self.max_concurrent_apps = default.MAX_CONCURRENT_APPS
     self.max_subproc = default.MAX_SUBPROC
     self.max_io = default.MAX_IO
+    self.max_render_workers = default.MAX_RENDER_WORKERS
+    self.max_render_processes = default.MAX_RENDER_PROCESSES
     self.dump_context = False
     self.stats = False
 
@@ -1,14 +1,27 @@
 import logging
+import os
+import re
 import yaml
 import fnmatch
+import hashlib
 from enum import StrEnum, auto
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+from collections.abc import Mapping
+
+try:
+  from yaml import CSafeLoader as SafeLoader
+except ImportError:
+  from yaml import SafeLoader
 
 from make_argocd_fly import default
 from make_argocd_fly.cliparam import get_cli_params
 from make_argocd_fly.param import Params
-from make_argocd_fly.util import build_path, merge_dicts_without_duplicates, merge_dicts_with_overrides, VarsResolver
+from make_argocd_fly.util import (build_path, merge_dicts_without_duplicates, merge_dicts_with_overrides, VarsResolver,
+                                  find_var_references, merge_top_level_keys, LayeredMapping)
 from make_argocd_fly.exception import ConfigFileError, MergeError, AppError, InternalError
-from make_argocd_fly.resource.viewer import build_scoped_viewer, ResourceType
+from make_argocd_fly.resource.viewer import build_scoped_viewer, ResourceType, ScopedViewer
+from make_argocd_fly.resource.snapshot import Snapshot, load_cache_file, save_cache_file
 
 
 log = logging.getLogger(__name__)
@@ -21,6 +34,17 @@ class ConfigKeywords(StrEnum):
   PARAMS = auto()
 
 
+class _VarsLayer:
+  '''Resolved forms of one `vars` scope, keyed by what they depend on outside of the scope.'''
+  __slots__ = ('scope', 'var_identifier', 'references', 'resolved')
+
+  def __init__(self, scope: dict, var_identifier: str) -> None:
+    self.scope = scope
+    self.var_identifier = var_identifier
+    self.references = find_var_references(scope, var_identifier)
+    self.resolved: dict[tuple, dict] = {}
+
+
 class Config:
   def __init__(self) -> None:
     self.config = None
@@ -28,11 +52,37 @@ class Config:
     self._runtime_output_dir = None
     self._final_output_dir = None
     self._tmp_dir = None
+    self._cache_dir = None
+    self._populated_with: dict = {}
+    self._vars_layers: dict[tuple[ConfigKeywords, str | None], _VarsLayer] = {}
+    self._shared_vars: dict[tuple, tuple[tuple[dict, ...], dict, frozenset[str]]] = {}
+    self._envs: Mapping[str, dict] = MappingProxyType({})
+    self._apps: Mapping[str, Mapping[str, dict]] = MappingProxyType({})
+    self._env_params: dict[str | None, tuple[tuple[dict, dict], dict]] = {}
+    self._name_filters: dict[str, re.Pattern] = {}
+    self._filtered_apps: tuple[tuple[str | None, str | None], tuple[tuple[str, str], ...]] | None = None
+    self._params: dict[tuple[str | None, str | None], tuple[dict, dict, Params]] = {}
 
     self.cli_params = get_cli_params()
 
   def populate_config(self, **kwargs) -> None:
+    self._populated_with = {**self._populated_with, **kwargs}
     self.__dict__.update(kwargs)
+    self._vars_layers = {}
+    self._shared_vars = {}
+    self._env_params = {}
+    self._params = {}
+    self._filtered_apps = None
+    self._build_indexes()
+
+  def _build_indexes(self) -> None:
+    '''Read-only lookup tables of envs and of apps per env, so that lookups do not rebuild name lists.'''
+    envs = (self.config or {}).get(ConfigKeywords.ENVS) or {}
+    self._envs = MappingProxyType(dict(envs))
+    self._apps = MappingProxyType({
+      env_name: MappingProxyType(dict(env[ConfigKeywords.APPS] or {}))
+      for env_name, env in envs.items() if isinstance(env, dict) and ConfigKeywords.APPS in env
+    })
 
   @property
   def source_dir(self) -> str:
@@ -62,6 +112,16 @@ class Config:
 
     return self._tmp_dir
 
+  @property
+  def cache_dir(self) -> str | None:
+    '''Directory for data kept between runs, None if caching is disabled.'''
+    return self._cache_dir
+
+  @property
+  def populated_with(self) -> dict:
+    '''Arguments of `populate_config`, to populate the config of another process (e.g. a render worker) the same way.'''
+    return self._populated_with
+
   def list_envs(self) -> list[str]:
     if self.config is None:
       raise InternalError('Config is not populated')
@@ -70,16 +130,26 @@ class Config:
       log.warning('Missing `envs` keyword in config')
       return []
 
-    return list(self.config[ConfigKeywords.ENVS].keys())
+    return list(self._envs)
 
   def get_env(self, env_name: str) -> dict:
     if self.config is None:
       raise InternalError('Config is not populated')
 
-    if env_name not in self.list_envs():
+    if env_name not in self._envs:
       raise ConfigFileError(f'Environment `{env_name}` is not defined')
 
-    return self.config[ConfigKeywords.ENVS][env_name]
+    return self._envs[env_name]
+
+  def _get_name_filter(self, patterns: str) -> re.Pattern:
+    """Compile comma-separated glob patterns (as in --render-envs) into one regex, matched like fnmatch.fnmatch."""
+    name_filter = self._name_filters.get(patterns)
+    if name_filter is None:
+      globs = sorted({os.path.normcase(pattern.strip()) for pattern in patterns.split(',')})
+      name_filter = re.compile('|'.join(f'(?:{fnmatch.translate(glob)})' for glob in globs))
+      self._name_filters[patterns] = name_filter
+
+    return name_filter
 
   def list_filtered_envs(self) -> list[str]:
     """Return envs filtered according to --render-envs, if provided."""
@@ -89,19 +159,19 @@ class Config:
     if render_envs is None:
       return envs
 
-    patterns = list(set([p.strip() for p in list(render_envs.split(','))]))
-    return [env for env in envs if any(fnmatch.fnmatch(env, pat) for pat in patterns)]
+    name_filter = self._get_name_filter(render_envs)
+    return [env for env in envs if name_filter.match(os.path.normcase(env))]
 
   def list_apps(self, env_name: str) -> list[str]:
     if self.config is None:
       raise InternalError('Config is not populated')
 
-    env = self.get_env(env_name)
-    if ConfigKeywords.APPS not in env:
+    self.get_env(env_name)
+    if env_name not in self._apps:
       log.warning(f'Missing `apps` keyword in environment {env_name}')
       return []
 
-    return list(env[ConfigKeywords.APPS].keys())
+    return list(self._apps[env_name])
 
   def list_filtered_apps(self, env_name: str) -> list[str]:
     """Return apps in env filtered according to --render-apps, if provided."""
@@ -110,18 +180,32 @@ class Config:
     if render_apps is None:
       return apps
 
-    patterns = list(set([p.strip() for p in list(render_apps.split(','))]))
-    return [app for app in apps if any(fnmatch.fnmatch(app, pat) for pat in patterns)]
+    name_filter = self._get_name_filter(render_apps)
+    return [app for app in apps if name_filter.match(os.path.normcase(app))]
+
+  def list_filtered_env_apps(self) -> tuple[tuple[str, str], ...]:
+    """
+    Return (env_name, app_name) pairs selected by --render-envs and --render-apps, in config order.
+    Computed once per populated config and filters, and shared by everything that needs the selection.
+    """
+    filters = (self.cli_params.render_envs, self.cli_params.render_apps)
+    if self._filtered_apps is None or self._filtered_apps[0] != filters:
+      self._filtered_apps = (filters, tuple((env_name, app_name)
+                                            for env_name in self.list_filtered_envs()
+                                            for app_name in self.list_filtered_apps(env_name)))
+
+    return self._filtered_apps[1]
 
   def get_app(self, env_name: str, app_name: str) -> dict:
     if self.config is None:
       raise InternalError('Config is not populated')
 
-    env = self.get_env(env_name)
-    if app_name not in self.list_apps(env_name):
+    self.get_env(env_name)
+    apps = self._apps.get(env_name, {})
+    if app_name not in apps:
       raise ConfigFileError(f'Application `{app_name}` is not defined in environment `{env_name}`')
 
-    return env[ConfigKeywords.APPS][app_name]
+    return apps[app_name]
 
   def _get_global_scope(self, keyword: ConfigKeywords) -> dict:
     if self.config is None:
@@ -139,96 +223,218 @@ class Config:
 
     return app[keyword] if keyword in app else {}
 
-  def get_vars(self, env_name: str | None = None, app_name: str | None = None, extra_vars: dict | None = None) -> dict:
+  def _resolve_vars_layer(self,
+                          layer_name: tuple[ConfigKeywords, str | None],
+                          scope_vars: dict,
+                          parent_layers: list[dict],
+                          extra_vars: dict,
+                          parent_key: tuple) -> tuple[dict, tuple]:
+    '''
+    Resolve `scope_vars` against `extra_vars` and the resolved layers above it (`parent_layers`).
+    The resolved scope only depends on the layers above (`parent_key`) and on the `extra_vars`
+    it references, so it is computed once per distinct key rather than once per application.
+    '''
+    var_identifier = self.cli_params.var_identifier
+
+    layer = self._vars_layers.get(layer_name)
+    if layer is None or layer.scope is not scope_vars or layer.var_identifier != var_identifier:
+      layer = _VarsLayer(scope_vars, var_identifier)
+      self._vars_layers[layer_name] = layer
+
+    # extra vars referenced directly or through other referenced extra vars
+    referenced, pending = set(), list(layer.references)
+    while pending:
+      name = pending.pop()
+      if name not in referenced and name in extra_vars:
+        referenced.add(name)
+        pending.extend(find_var_references(extra_vars[name], var_identifier))
+
+    key = parent_key + tuple(sorted((name, repr(extra_vars[name])) for name in referenced))
+    if key not in layer.resolved:
+      layer.resolved[key] = VarsResolver.resolve_all(scope_vars,
+                                                     merge_dicts_with_overrides(extra_vars, *parent_layers, scope_vars),
+                                                     var_identifier=var_identifier,
+                                                     allow_unresolved=True)
+
+    return layer.resolved[key], (layer_name, key)
+
+  def _get_shared_vars(self, key: tuple, layers: list[dict]) -> tuple[dict, frozenset[str]]:
+    '''
+    Merged resolved `layers`, shared by all applications with the same layer `key`, and the top-level
+    names whose values still hold references (these are resolved again per application).
+    '''
+    cached = self._shared_vars.get(key)
+    if cached is None or len(cached[0]) != len(layers) or any(a is not b for a, b in zip(cached[0], layers)):
+      shared = merge_dicts_with_overrides(*layers)
+      var_identifier = self.cli_params.var_identifier
+      unresolved = frozenset(name for name, value in shared.items() if find_var_references(value, var_identifier))
+      cached = (tuple(layers), shared, unresolved)
+      self._shared_vars[key] = cached
+
+    return cached[1], cached[2]
+
+  def get_vars(self, env_name: str | None = None, app_name: str | None = None, extra_vars: dict | None = None) -> Mapping:
+    '''
+    Resolved vars of an application (or env or global ones) as a read-only mapping. Global and env
+    vars are shared between applications, only the names set or changed by the application are its own.
+    '''
     if extra_vars is None:
       extra_vars = {}
+    var_identifier = self.cli_params.var_identifier
 
     global_vars = self._get_global_scope(ConfigKeywords.VARS)
     env_vars = self._get_env_scope(ConfigKeywords.VARS, env_name) if env_name else {}
     app_vars = self._get_app_scope(ConfigKeywords.VARS, env_name, app_name) if env_name and app_name else {}
 
-    resolved_vars = merge_dicts_with_overrides(
-      extra_vars,
-      VarsResolver.resolve_all(global_vars,
-                               merge_dicts_with_overrides(extra_vars, global_vars),
-                               var_identifier=self.cli_params.var_identifier,
-                               allow_unresolved=True)
-    )
+    layers = []
+    resolved_layer, key = self._resolve_vars_layer((ConfigKeywords.VARS, None), global_vars, layers, extra_vars, ())
+    layers.append(resolved_layer)
 
     if env_name:
-      resolved_vars = merge_dicts_with_overrides(
-        resolved_vars,
-        VarsResolver.resolve_all(env_vars,
-                                 merge_dicts_with_overrides(resolved_vars, env_vars),
-                                 var_identifier=self.cli_params.var_identifier,
-                                 allow_unresolved=True)
-      )
+      resolved_layer, key = self._resolve_vars_layer((ConfigKeywords.ENVS, env_name), env_vars, layers, extra_vars, key)
+      layers.append(resolved_layer)
+
+    shared_vars, unresolved = self._get_shared_vars(key, layers)
 
     if env_name and app_name:
-      resolved_vars = merge_dicts_with_overrides(
-        resolved_vars,
-        VarsResolver.resolve_all(app_vars,
-                                 merge_dicts_with_overrides(resolved_vars, app_vars),
-                                 var_identifier=self.cli_params.var_identifier,
-                                 allow_unresolved=True)
-      )
+      app_vars = VarsResolver.resolve_all(app_vars,
+                                          merge_top_level_keys([extra_vars, *layers, app_vars], shared_vars, extra_vars.keys() | app_vars.keys()),
+                                          var_identifier=var_identifier,
+                                          allow_unresolved=True)
+
+    own_names = extra_vars.keys() | app_vars.keys()
+    merged_vars = merge_top_level_keys([extra_vars, *layers, app_vars], shared_vars, own_names)
+    own_vars = VarsResolver.resolve_all({name: value for name, value in merged_vars.items() if name in own_names or name in unresolved},
+                                        merged_vars,
+                                        var_identifier=var_identifier,
+                                        allow_unresolved=True)
+
+    return LayeredMapping(own_vars, shared_vars, hidden=shared_vars.keys() - merged_vars.keys())
+
+  def _get_env_params(self, env_name: str | None) -> dict:
+    '''Global params overridden by the params of `env_name`, merged once per env.'''
+    scopes = (self._get_global_scope(ConfigKeywords.PARAMS),
+              self._get_env_scope(ConfigKeywords.PARAMS, env_name) if env_name else {})
 
-    resolved_vars = VarsResolver.resolve_all(resolved_vars,
-                                             resolved_vars,
-                                             var_identifier=self.cli_params.var_identifier,
-                                             allow_unresolved=True)
+    cached = self._env_params.get(env_name)
+    if cached is None or not all(map(_is_same_scope, cached[0], scopes)):
+      cached = (scopes, merge_dicts_with_overrides(*scopes))
+      self._env_params[env_name] = cached
 
-    return resolved_vars
+    return cached[1]
 
   def get_params(self, env_name: str | None = None, app_name: str | None = None) -> Params:
-    global_params = self._get_global_scope(ConfigKeywords.PARAMS)
-    env_params = self._get_env_scope(ConfigKeywords.PARAMS, env_name) if env_name else {}
+    '''Params are built once per (env, app) and shared between callers, so they are read-only.'''
+    env_params = self._get_env_params(env_name)
     app_params = self._get_app_scope(ConfigKeywords.PARAMS, env_name, app_name) if env_name and app_name else {}
 
+    cached = self._params.get((env_name, app_name))
+    if cached is not None and cached[0] is env_params and _is_same_scope(cached[1], app_params):
+      return cached[2]
+
     params = Params()
     try:
-      params.populate_params(**merge_dicts_with_overrides(global_params, env_params, app_params))
+      params.populate_params(**merge_dicts_with_overrides(env_params, app_params))
     except ConfigFileError as e:
       log.error(f'{e}')
       raise AppError(app_name or '<undefined>', env_name or '<undefined>', 'Error populating params') from e
 
+    self._params[(env_name, app_name)] = (env_params, app_params, params.freeze())
+
     return params
 
 
 config = Config()
 
 
+def _is_same_scope(cached: dict, scope: dict) -> bool:
+  '''Whether a cache built from `cached` is valid for `scope`; missing scopes are new empty dicts on every lookup.'''
+  return cached is scope or (not cached and not scope)
+
+
+def _load_config_file(rel_path: str, content: str) -> dict:
+  try:
+    return yaml.load(content, Loader=SafeLoader)
+  except yaml.YAMLError as e:
+    raise ConfigFileError(f'Invalid YAML in config file `{rel_path}`: {e}') from e
+
+
+def _parse_config_files(config_files: list[tuple[str, str]]) -> list[dict]:
+  '''
+  Parse (rel_path, content) config files, in the order given. PyYAML holds the GIL, so large
+  config files are parsed in worker processes instead; starting them costs more than parsing
+  any number of small files.
+  '''
+  workers = min(len(config_files), os.cpu_count() or 1)
+  if workers < 2 or sum(len(content) for _, content in config_files) < default.CONFIG_PARSE_PROCESSES_MIN_BYTES:
+    return [_load_config_file(rel_path, content) for rel_path, content in config_files]
+
+  log.debug(f'Parsing {len(config_files)} config files in {workers} processes')
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    return list(executor.map(_load_config_file, *zip(*config_files)))
+
+
+def _load_merged_config(viewer: ScopedViewer, cache_path: str | None) -> dict:
+  '''
+  Parse and merge all config files. With `cache_path` the merged config is kept on disk,
+  keyed by the paths and contents of the config files, and reused while they are unchanged.
+  '''
+  config_files = []
+  for child in viewer.search_subresources(resource_types=[ResourceType.YAML], template=False):
+    log.debug(f'Found config file: {child.rel_path}')
+    config_files.append((child.rel_path, child.content))
+
+  key = None
+  if cache_path:
+    digest = hashlib.sha256()
+    for rel_path, content in config_files:
+      digest.update(f'{len(rel_path)}:{rel_path}{len(content)}:'.encode())
+      digest.update(content.encode())
+    key = digest.hexdigest()
+
+    cached = load_cache_file(cache_path)
+    if isinstance(cached, tuple) and cached[0] == key:
+      log.debug(f'Using cached config from {cache_path}')
+      return cached[1]
+
+  try:
+    merged_config = merge_dicts_without_duplicates(*_parse_config_files(config_files))
+  except MergeError as e:
+    raise ConfigFileError(f'Error merging config files: {e}') from e
+
+  if cache_path:
+    save_cache_file(cache_path, (key, merged_config))
+
+  return merged_config
+
+
 def populate_config(root_dir: str = default.ROOT_DIR,
                     config_dir: str = default.CONFIG_DIR,
                     source_dir: str = default.SOURCE_DIR,
                     output_dir: str = default.OUTPUT_DIR,
-                    tmp_dir: str = default.TMP_DIR) -> Config:
-  try:
-    viewer = build_scoped_viewer(build_path(root_dir, config_dir))
-    yml_children = list(viewer.search_subresources(resource_types=[ResourceType.YAML], template=False))
-
-    config_files_content = []
-    for child in yml_children:
-      log.debug(f'Found config file: {child.rel_path}')
-      try:
-        config_files_content.append(yaml.safe_load(child.content))
-      except yaml.YAMLError as e:
-        raise ConfigFileError(f'Invalid YAML in config file `{child.rel_path}`: {e}') from e
-
-    merged_config = merge_dicts_without_duplicates(*config_files_content)
-  except MergeError as e:
-    raise ConfigFileError(f'Error merging config files: {e}') from e
+                    tmp_dir: str = default.TMP_DIR,
+                    cache_dir: str | None = None) -> Config:
+  cache_dir = build_path(root_dir, cache_dir, allow_missing=True) if cache_dir else None
+  snapshot = Snapshot.load(os.path.join(cache_dir, default.CONFIG_SNAPSHOT_FILE)) if cache_dir else None
+
+  viewer = build_scoped_viewer(build_path(root_dir, config_dir), snapshot=snapshot)
+  merged_config = _load_merged_config(viewer, os.path.join(cache_dir, default.CONFIG_CACHE_FILE) if cache_dir else None)
+
+  if snapshot:
+    snapshot.save()
 
   config.populate_config(config=merged_config,
                          _source_dir=build_path(root_dir, source_dir),
                          _runtime_output_dir=build_path(root_dir, f'{default.RUNTIME_DIR_PREFIX}{output_dir}', allow_missing=True),
                          _final_output_dir=build_path(root_dir, output_dir, allow_missing=True),
-                         _tmp_dir=build_path(root_dir, tmp_dir, allow_missing=True))
+                         _tmp_dir=build_path(root_dir, tmp_dir, allow_missing=True),
+                         _cache_dir=cache_dir)
 
   log.debug(f'Config directory: {build_path(root_dir, config_dir)}')
   log.debug(f'Source directory: {config.source_dir}')
   log.debug(f'Output directory: {config.final_output_dir}')
   log.debug(f'Temporary directory: {config.tmp_dir}')
+  log.debug(f'Cache directory: {config.cache_dir}')
 
   return config
 
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from typing import Any
+from collections.abc import Mapping
 from make_argocd_fly.resource.viewer import ResourceType
 from make_argocd_fly.type import WriterType
 
@@ -7,7 +8,7 @@ from make_argocd_fly.type import WriterType
 @dataclass
 class TemplatedResource:
   resource_type: ResourceType
-  vars: dict
+  vars: Mapping
   data: str
   origin: str
   source_path: str | None = None
@@ -23,6 +24,7 @@ class Resource:
   yaml_obj: Any | None = None
   output_path: str | None = None
   writer_type: WriterType = WriterType.GENERIC
+  source_file: str | None = None  # file on disk copied as is by passthrough writers
 
   def with_yaml(self, obj: Any) -> 'Resource':
     return Resource(
@@ -33,6 +35,7 @@ class Resource:
       yaml_obj=obj,
       output_path=self.output_path,
       writer_type=WriterType.K8S_YAML,
+      source_file=self.source_file,
     )
 
   def with_output_path(self, output_path: str) -> 'Resource':
@@ -44,4 +47,5 @@ class Resource:
       yaml_obj=self.yaml_obj,
       output_path=output_path,
       writer_type=self.writer_type,
+      source_file=self.source_file,
     )
@@ -3,6 +3,7 @@ import json
 import logging
 from dataclasses import is_dataclass, asdict
 from typing import Any
+from collections.abc import Mapping
 
 from make_argocd_fly.context import Context, ctx_get, resolve_expr
 from make_argocd_fly.stage import Stage
@@ -17,7 +18,7 @@ def _serialize_debug(value: Any) -> Any:
     return value
   if isinstance(value, (list, tuple, set)):
     return [_serialize_debug(v) for v in value]
-  if isinstance(value, dict):
+  if isinstance(value, Mapping):
     return {str(k): _serialize_debug(v) for k, v in value.items()}
   if is_dataclass(value):
     return _serialize_debug(asdict(value))
@@ -12,11 +12,22 @@ KUSTOMIZE_DIR = 'kustomize'
 HELMFILE_DIR = 'helmfile'
 TMP_DIR = '.tmp'
 LOG_CONFIG_FILE = 'log_config.yml'
+SOURCE_SNAPSHOT_FILE = 'source.snapshot'
+CONFIG_SNAPSHOT_FILE = 'config.snapshot'
+CONFIG_CACHE_FILE = 'config.cache'
+JINJA_CACHE_DIR = 'jinja'
 VAR_IDENTIFIER = '$'
 LOGLEVEL = 'INFO'
 MAX_CONCURRENT_APPS = 8
 MAX_SUBPROC = os.cpu_count() or 4
 MAX_IO = 32
+MAX_RENDER_WORKERS = os.cpu_count() or 4
+# templates are rendered in worker processes when set above 0
+MAX_RENDER_PROCESSES = 0
+# config files are parsed in worker processes from this many bytes on in total
+CONFIG_PARSE_PROCESSES_MIN_BYTES = 1024 * 1024
+# compiled Jinja2 templates kept in memory per process
+JINJA_TEMPLATE_CACHE_SIZE = 1024
 
 ARGOCD_APPLICATION_CR_TEMPLATE = '''\
   apiVersion: argoproj.io/v1alpha1
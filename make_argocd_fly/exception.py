@@ -1,6 +1,19 @@
 class MakeArgoCDFlyError(Exception):
   '''Base class for all project-specific exceptions.'''
 
+  def __reduce__(self):
+    # subclasses take other arguments than `args`, so they are restored without calling __init__
+    # (e.g. when raised in a render worker process)
+    return _restore_error, (self.__class__, self.args, self.__dict__)
+
+
+def _restore_error(cls: type, args: tuple, state: dict) -> MakeArgoCDFlyError:
+  error = cls.__new__(cls, *args)
+  error.args = args
+  error.__dict__.update(state)
+
+  return error
+
 
 class UserError(MakeArgoCDFlyError):
   '''Invalid user input, config, templates, paths, or application content.'''
@@ -1,4 +1,5 @@
 import asyncio
+from concurrent.futures import Executor
 from dataclasses import dataclass
 
 
@@ -7,3 +8,7 @@ class RuntimeLimits:
   app_sem: asyncio.Semaphore
   subproc_sem: asyncio.Semaphore
   io_sem: asyncio.Semaphore
+  # templates are rendered on the event loop when no executor is given
+  render_executor: Executor | None = None
+  # takes precedence over render_executor; its workers must have the config populated
+  render_process_executor: Executor | None = None
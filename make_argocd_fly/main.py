@@ -4,13 +4,16 @@ import time
 import os
 import asyncio
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import yamllint
 from deprecated import deprecated
 
 from make_argocd_fly import default
 from make_argocd_fly.warning import init_warnings
 from make_argocd_fly.resource.viewer import build_scoped_viewer
-from make_argocd_fly.cliparam import populate_cli_params, get_cli_params
+from make_argocd_fly.resource.snapshot import Snapshot
+from make_argocd_fly.renderer import prune_bytecode_cache
+from make_argocd_fly.cliparam import populate_cli_params, get_cli_params, CLIParams
 from make_argocd_fly.config import populate_config, get_config, Config
 from make_argocd_fly.util import (init_logging, latest_version_check, get_package_name, get_current_version,
                                   remove_dir, move_dir, copy_dir_hardlinked)
@@ -36,25 +39,59 @@ async def run_one_app(pipeline, ctx, limits: RuntimeLimits,
     log.info(f'[{counter[0]}/{total}] Rendered application {ctx.app_name} ({ctx.env_name})')
 
 
+def _init_render_process(cli_kwargs: dict, config_kwargs: dict) -> None:
+  '''
+  Set up a render worker process like the main one, with the config already merged by it, so that
+  workers neither parse the config files again nor write the config snapshot.
+  '''
+  init_logging(cli_kwargs['loglevel'])
+  populate_cli_params(**cli_kwargs)
+  get_config().populate_config(**config_kwargs)
+
+
+def _build_render_executors(cli_params: CLIParams) -> tuple[ThreadPoolExecutor | None, ProcessPoolExecutor | None]:
+  # without render threads templates are rendered on the event loop
+  render_executor = None
+  if cli_params.max_render_workers > 0:
+    render_executor = ThreadPoolExecutor(max_workers=cli_params.max_render_workers, thread_name_prefix='render')
+  render_process_executor = None
+  if cli_params.max_render_processes > 0:
+    render_process_executor = ProcessPoolExecutor(max_workers=cli_params.max_render_processes,
+                                                  initializer=_init_render_process,
+                                                  initargs=(dict(vars(cli_params)), get_config().populated_with))
+
+  return render_executor, render_process_executor
+
+
 async def generate() -> None:
   config = get_config()
   cli_params = get_cli_params()
+  started = time.time()
 
+  render_executor, render_process_executor = _build_render_executors(cli_params)
   limits = RuntimeLimits(
     app_sem=asyncio.Semaphore(cli_params.max_concurrent_apps),
     subproc_sem=asyncio.Semaphore(cli_params.max_subproc),
     io_sem=asyncio.Semaphore(cli_params.max_io),
+    render_executor=render_executor,
+    render_process_executor=render_process_executor,
   )
   apps = []
 
-  viewer = build_scoped_viewer(config.source_dir)
+  filtered_apps = config.list_filtered_env_apps()
+
+  # Partial runs build only the subtrees of the selected apps up front, anything
+  # else (e.g. shared templates) is loaded when a template reaches for it
+  partial_run = bool(cli_params.render_envs or cli_params.render_apps)
+  scope = sorted({app_name for _, app_name in filtered_apps}) if partial_run else None
+  snapshot = Snapshot.load(os.path.join(config.cache_dir, default.SOURCE_SNAPSHOT_FILE)) if config.cache_dir else None
+  viewer = build_scoped_viewer(config.source_dir, max_workers=cli_params.max_io, scope=scope, snapshot=snapshot)
 
-  for env_name in config.list_filtered_envs():
-    for app_name in config.list_filtered_apps(env_name):
-      ctx = Context(env_name, app_name, params=config.get_params(env_name, app_name))
-      pipeline = build_pipeline(ctx, limits, viewer)
+  for env_name, app_name in filtered_apps:
+    ctx = Context(env_name, app_name, params=config.get_params(env_name, app_name))
+    pipeline = build_pipeline(ctx, limits, viewer)
 
-      apps.append((pipeline, ctx))
+    apps.append((pipeline, ctx))
 
   total = len(apps)
   counter = [0]  # shared mutable counter for progress tracking
@@ -71,9 +108,20 @@ async def generate() -> None:
       raise e.exceptions[0]
     else:
       raise e
+  finally:
+    if render_executor is not None:
+      render_executor.shutdown(cancel_futures=True)
+    if render_process_executor is not None:
+      render_process_executor.shutdown(cancel_futures=True)
   t1 = time.perf_counter()
   wall_ms = (t1 - t0) * 1000.0
 
+  if snapshot:
+    # partial runs read only a part of the tree, keep what the previous runs read elsewhere
+    snapshot.save(prune=not partial_run)
+  if config.cache_dir and not partial_run:
+    prune_bytecode_cache(config.cache_dir, used_since=started)
+
   if cli_params.stats:
     print_stats(apps, wall_ms=wall_ms)
 
@@ -126,11 +174,7 @@ def deprecation_warning() -> None:
 
 def _copy_unfiltered_apps(config: Config, src: str, dst: str) -> None:
   """During a partial run, copy only apps that won't be re-rendered."""
-  filtered = {
-    (env_name, app_name)
-    for env_name in config.list_filtered_envs()
-    for app_name in config.list_filtered_apps(env_name)
-  }
+  filtered = set(config.list_filtered_env_apps())
 
   for env_name in config.list_envs():
     for app_name in config.list_apps(env_name):
@@ -152,7 +196,8 @@ def main(**kwargs) -> None:  # noqa: C901
                              cli_params.config_dir,
                              cli_params.source_dir,
                              cli_params.output_dir,
-                             cli_params.tmp_dir)
+                             cli_params.tmp_dir,
+                             cli_params.cache_dir)
 
     latest_version_check()
 
@@ -211,6 +256,8 @@ def cli_entry_point() -> None:
   parser.add_argument('--source-dir', type=str, default=default.SOURCE_DIR, help='Source files directory (default: source)')
   parser.add_argument('--output-dir', type=str, default=default.OUTPUT_DIR, help='Output files directory (default: output)')
   parser.add_argument('--tmp-dir', type=str, default=default.TMP_DIR, help='Temporary files directory (default: .tmp)')
+  parser.add_argument('--cache-dir', type=str, default=None,
+                      help='Directory for data reused between runs, e.g. source tree snapshots (default: caching disabled)')
   parser.add_argument('--render-apps', type=str, default=None, help='Comma separate list of applications to render')
   parser.add_argument('--render-envs', type=str, default=None, help='Comma separate list of environments to render')
   parser.add_argument('--skip-generate', action='store_true', help='Skip resource generation')
@@ -228,6 +275,10 @@ def cli_entry_point() -> None:
   parser.add_argument('--dump-context', action='store_true', help='Dump per-stage context snapshots for debugging')
   parser.add_argument('--stats', action='store_true', help='Print execution time statistics per stage and per application')
   parser.add_argument('--max-io', type=int, default=default.MAX_IO, help='Maximum number of I/O operations to run concurrently (default: 32)')
+  parser.add_argument('--max-render-workers', type=int, default=default.MAX_RENDER_WORKERS,
+                      help='Maximum number of threads rendering templates concurrently, 0 renders on the event loop (default: number of CPU cores)')
+  parser.add_argument('--max-render-processes', type=int, default=default.MAX_RENDER_PROCESSES,
+                      help='Number of worker processes rendering templates, 0 renders in threads (default: 0)')
   parser.add_argument('--loglevel', type=str, default=default.LOGLEVEL, help='DEBUG, INFO, WARNING, ERROR, CRITICAL')
   parser.add_argument('--version', action='version', version=f'{get_package_name()} {get_current_version()}', help='Show version')
   args = parser.parse_args()
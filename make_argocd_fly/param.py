@@ -1,7 +1,7 @@
 import logging
 from enum import StrEnum, auto
 
-from make_argocd_fly.exception import ConfigFileError
+from make_argocd_fly.exception import ConfigFileError, InternalError
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +31,10 @@ class ParamNames(StrEnum):
 
 
 class Params:
+  # `_frozen` goes last so that copies and unpickled objects get their values before being frozen
+  __slots__ = ('app_type', 'parent_app', 'parent_app_env', 'non_k8s_files_to_render', 'exclude_rendering',
+               'kustomize_common_dirs', 'application_name', '_frozen')
+
   def __init__(self) -> None:
     self.app_type = ApplicationTypes.K8S
     self.parent_app = None
@@ -39,6 +43,18 @@ class Params:
     self.exclude_rendering = []
     self.kustomize_common_dirs = []
     self.application_name = ApplicationNameFormat.SHORT
+    self._frozen = False
+
+  def __setattr__(self, name: str, value) -> None:
+    if getattr(self, '_frozen', False):
+      raise InternalError(f'Cannot set `{name}`, params are read-only')
+
+    super().__setattr__(name, value)
+
+  def freeze(self) -> 'Params':
+    '''Make params read-only, so that they can be shared between users.'''
+    self._frozen = True
+    return self
 
   def populate_params(self, **kwargs) -> None:
     for param in kwargs:
@@ -58,4 +74,5 @@ class Params:
       raise ConfigFileError(f'Unknown application_name value `{kwargs["application_name"]}`. '
                             f'Valid values: {[f.value for f in ApplicationNameFormat]}')
 
-    self.__dict__.update(kwargs)
+    for param, value in kwargs.items():
+      setattr(self, param, value)
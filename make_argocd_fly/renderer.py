@@ -2,12 +2,22 @@ import logging
 import os
 import re
 import socket
+import fnmatch
+import hashlib
+import threading
 import jinja2
 from typing import Tuple, Callable, Union, List, Any
-from jinja2 import Environment, FunctionLoader, nodes, StrictUndefined
+from collections import OrderedDict, ChainMap
+from collections.abc import Mapping, MutableMapping
+from contextvars import ContextVar
+from jinja2 import Environment, FunctionLoader, Template, nodes, StrictUndefined
+from jinja2.bccache import FileSystemBytecodeCache
 from jinja2.ext import Extension
+from jinja2.runtime import Context
+from jinja2.utils import missing
 from markupsafe import Markup
 
+from make_argocd_fly import default
 from make_argocd_fly.config import get_config
 from make_argocd_fly.resource.viewer import ResourceType, ScopedViewer
 from make_argocd_fly.exception import UndefinedTemplateVariableError, PathDoesNotExistError, InternalError
@@ -35,10 +45,20 @@ class CustomFunctionLoader(FunctionLoader):
         load_func: Callable[[str], Union[str, Tuple[str, str | None, Callable[[], bool] | None]]],
         render_func: Callable[[str], Union[str, Tuple[str, str | None, Callable[[], bool] | None]]],
         list_func: Callable[[str], List[ScopedViewer]],
+        template_func: Callable[[str, str], Template] | None = None,
   ) -> None:
     super().__init__(load_func)
     self.render_func = render_func
     self.list_func = list_func
+    self.template_func = template_func
+
+  def load(self, environment: 'Environment', name: str, globals: MutableMapping[str, Any] | None = None) -> Template:
+    if self.template_func is None:
+      return super().load(environment, name, globals)
+
+    (source, filename, _) = self.get_source(environment, name)
+
+    return self.template_func(source, filename or name)
 
   def get_rendered(self, environment: 'Environment', template: str) -> Tuple[str, str | None, Callable[[], bool] | None]:
     rv = self.render_func(template)
@@ -84,6 +104,10 @@ class FileListExtension(Extension):
     return nodes.Output([result], lineno=lineno)
 
   def _render(self, dir_path: str, prepend_path: str | None = None) -> str:
+    return _active_renderer().memoize_expansion(('file_list', os.path.normpath(dir_path), prepend_path),
+                                                lambda: self._expand(dir_path, prepend_path))
+
+  def _expand(self, dir_path: str, prepend_path: str | None) -> str:
     if not self.environment.loader:
       raise InternalError("Jinja2 environment loader is not set")
 
@@ -122,6 +146,9 @@ class IncludeMapExtension(Extension):
     return nodes.Output([result], lineno=lineno)
 
   def _render(self, path: str) -> str:
+    return _active_renderer().memoize_expansion(('include_map', os.path.normpath(path)), lambda: self._expand(path))
+
+  def _expand(self, path: str) -> str:
     if not self.environment.loader:
       raise InternalError("Jinja2 environment loader is not set")
 
@@ -156,6 +183,9 @@ class RawIncludeMapExtension(Extension):
     return nodes.Output([result], lineno=lineno)
 
   def _render(self, path: str) -> str:
+    return _active_renderer().memoize_raw_expansion('rawinclude_map', path, lambda: self._expand(path))
+
+  def _expand(self, path: str) -> str:
     if not self.environment.loader:
       raise InternalError("Jinja2 environment loader is not set")
 
@@ -186,6 +216,9 @@ class IncludeListExtension(Extension):
     return nodes.Output([result], lineno=lineno)
 
   def _render(self, path: str) -> str:
+    return _active_renderer().memoize_expansion(('include_list', os.path.normpath(path)), lambda: self._expand(path))
+
+  def _expand(self, path: str) -> str:
     if not self.environment.loader:
       raise InternalError("Jinja2 environment loader is not set")
 
@@ -217,6 +250,9 @@ class RawIncludeListExtension(Extension):
     return nodes.Output([result], lineno=lineno)
 
   def _render(self, path: str) -> str:
+    return _active_renderer().memoize_raw_expansion('rawinclude_list', path, lambda: self._expand(path))
+
+  def _expand(self, path: str) -> str:
     if not self.environment.loader:
       raise InternalError("Jinja2 environment loader is not set")
 
@@ -235,6 +271,217 @@ class RawIncludeListExtension(Extension):
     return Markup(''.join(kv_as_yaml_str))
 
 
+def _new_layered_context(environment: Environment, name: str | None, blocks: dict, parent: Mapping,
+                         globals: MutableMapping[str, Any] | None = None,
+                         locals: Mapping[str, Any] | None = None) -> Context:
+  if locals:
+    parent = ChainMap({key: value for key, value in locals.items() if value is not missing}, parent)
+
+  return environment.context_class(environment, parent, name, blocks, globals=globals)
+
+
+class _LayeredContext(Context):
+  """
+  Template context that chains its vars over its parent mapping instead of copying both
+  into a dict, for `include`s, `import`s and loop or block scopes.
+  """
+  def get_all(self) -> ChainMap:
+    # Jinja2 copies and changes this for tracebacks, so the first map has to be a dict
+    return ChainMap(self.vars, self.parent)
+
+  def derived(self, locals: dict[str, Any] | None = None) -> Context:
+    context = _new_layered_context(self.environment, self.name, {}, self.get_all(), locals=locals)
+    context.eval_ctx = self.eval_ctx
+    context.blocks.update((k, list(v)) for k, v in self.blocks.items())
+    return context
+
+  def keys(self):
+    return self.get_all().keys()
+
+  def values(self):
+    return self.get_all().values()
+
+  def items(self):
+    return self.get_all().items()
+
+
+class _LayeredTemplate(Template):
+  """
+  Template rendered with the given vars (chained over the globals) as the parent of its
+  context, instead of a dict copy of them. Only the vars a template reads are looked up,
+  so a `LayeredMapping` copies only those of its shared values.
+  """
+  def new_context(self, vars: Mapping[str, Any] | None = None, shared: bool = False,
+                  locals: Mapping[str, Any] | None = None) -> Context:
+    parent = vars if vars is not None else {}
+    if not shared:
+      parent = ChainMap(parent, self.globals)
+
+    return _new_layered_context(self.environment, self.name, self.blocks, parent, self.globals, locals)
+
+  def render(self, *args: Any, **kwargs: Any) -> str:
+    vars = args[0] if len(args) == 1 and not kwargs and isinstance(args[0], Mapping) else dict(*args, **kwargs)
+    context = self.new_context(vars)
+
+    try:
+      return self.environment.concat(self.root_render_func(context))
+    except Exception:
+      self.environment.handle_exception()
+
+
+# bucket files of the bytecode cache (Jinja2's default), by bucket key
+_BYTECODE_PATTERN = '__jinja2_%s.cache'
+# file systems with coarse timestamps may date a bucket used during a run before its start
+_BYTECODE_MTIME_SLACK = 2
+
+
+def prune_bytecode_cache(cache_dir: str, used_since: float) -> None:
+  """
+  Remove template bytecode kept in `cache_dir` that was neither written nor loaded since
+  `used_since` (a `time.time()` value), i.e. of templates that were edited or removed, or
+  compiled by another Jinja2 version. Buckets are touched when loaded, so that this works
+  for templates rendered in worker processes too.
+  """
+  bytecode_dir = os.path.join(cache_dir, default.JINJA_CACHE_DIR)
+  try:
+    names = os.listdir(bytecode_dir)
+  except FileNotFoundError:
+    return
+
+  removed = 0
+  for name in fnmatch.filter(names, _BYTECODE_PATTERN % '*'):
+    path = os.path.join(bytecode_dir, name)
+    try:
+      if os.stat(path).st_mtime < used_since - _BYTECODE_MTIME_SLACK:
+        os.remove(path)
+        removed += 1
+    except OSError as e:
+      log.debug(f'Failed to prune template bytecode {path}: {e}')
+
+  log.debug(f'Removed {removed} unused template bytecode file(s) from {bytecode_dir}')
+
+
+# renderer whose template is being rendered in the current context; the shared
+# environment's loader and finalize hook forward to it
+_current_renderer: ContextVar['JinjaRenderer'] = ContextVar('current_renderer')
+
+
+def _active_renderer() -> 'JinjaRenderer':
+  try:
+    return _current_renderer.get()
+  except LookupError:
+    raise InternalError('No template is being rendered') from None
+
+
+class _SharedEnvironment:
+  """
+  Jinja2 environment shared by all renderers of the process, built on first use.
+  Compiled templates are cached by digest of their file name and source, least recently
+  used ones are evicted once there are more than `max_templates`. Jinja2's own cache is
+  disabled: it is keyed by template name only, and names of `include`d files are relative
+  to the viewer of the active renderer, so the same name refers to different files in
+  different applications. With a cache dir set, template bytecode is also kept on disk,
+  keyed by that digest and the Jinja2 version, so that later runs do not compile
+  unchanged templates again.
+  """
+  def __init__(self, max_templates: int) -> None:
+    self.max_templates = max_templates
+    self._env: Environment | None = None
+    self._templates: OrderedDict[bytes, Template] = OrderedDict()
+    self._bytecode_dir: str | None = None
+    self._bytecode_cache: FileSystemBytecodeCache | None = None
+    # renderers may run on several threads
+    self._lock = threading.Lock()
+
+  @property
+  def env(self) -> Environment:
+    if self._env is None:
+      with self._lock:
+        if self._env is None:
+          self._env = self._build_env()
+
+    return self._env
+
+  def _build_env(self) -> Environment:
+    loader = CustomFunctionLoader(lambda path: _active_renderer()._get_source(path),
+                                  lambda path: _active_renderer()._get_rendered(path),
+                                  lambda path: _active_renderer()._list_templates(path),
+                                  lambda source, filename: self.get_template(source, filename))
+    env = Environment(extensions=[RawIncludeExtension,
+                                  FileListExtension,
+                                  IncludeMapExtension,
+                                  RawIncludeMapExtension,
+                                  IncludeListExtension,
+                                  RawIncludeListExtension,
+                                  DigExtension,
+                                  'jinja2_ansible_filters.AnsibleCoreFiltersExtension'],
+                      loader=loader,
+                      cache_size=0,
+                      undefined=StrictUndefined,
+                      finalize=lambda value: _active_renderer()._finalize(value))
+    env.template_class = _LayeredTemplate
+    env.context_class = _LayeredContext
+
+    return env
+
+  def set_cache_dir(self, cache_dir: str | None) -> None:
+    bytecode_dir = os.path.join(cache_dir, default.JINJA_CACHE_DIR) if cache_dir else None
+
+    with self._lock:
+      if bytecode_dir == self._bytecode_dir:
+        return
+
+      if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+      self._bytecode_dir = bytecode_dir
+      self._bytecode_cache = FileSystemBytecodeCache(bytecode_dir, _BYTECODE_PATTERN) if bytecode_dir else None
+
+  def _compile(self, key: bytes, content: str, filename: str) -> Template:
+    env = self.env
+    bytecode_cache = self._bytecode_cache
+    if bytecode_cache is None:
+      return env.template_class.from_code(env, env.compile(content, filename=filename), env.make_globals(None))
+
+    # bucket files are named after the template name only, so it has to identify the content
+    bucket = bytecode_cache.get_bucket(env, f'{key.hex()}-{jinja2.__version__}', None, content)
+    if bucket.code is None:
+      bucket.code = env.compile(content, filename=filename)
+      try:
+        bytecode_cache.set_bucket(bucket)
+      except OSError as e:
+        log.debug(f'Failed to write template bytecode: {e}')
+    else:
+      # buckets not touched by a full run are pruned, see prune_bytecode_cache
+      try:
+        os.utime(os.path.join(bytecode_cache.directory, _BYTECODE_PATTERN % bucket.key))
+      except OSError as e:
+        log.debug(f'Failed to touch template bytecode: {e}')
+
+    return env.template_class.from_code(env, bucket.code, env.make_globals(None))
+
+  def get_template(self, content: str, filename: str) -> Template:
+    # the file name is compiled into the template (and named in errors), so it is part of the key
+    key = hashlib.sha256(f'{filename}\0{content}'.encode()).digest()
+
+    with self._lock:
+      template = self._templates.get(key)
+      if template is not None:
+        self._templates.move_to_end(key)
+        return template
+
+    # compiled outside of the lock; two threads may compile the same template, the last one is kept
+    template = self._compile(key, content, filename)
+    with self._lock:
+      self._templates[key] = template
+      if len(self._templates) > self.max_templates:
+        self._templates.popitem(last=False)
+
+    return template
+
+
+_shared_environment = _SharedEnvironment(default.JINJA_TEMPLATE_CACHE_SIZE)
+
+
 class JinjaRenderer():
   file_types = [resource_type for resource_type in ResourceType if
                 (resource_type != ResourceType.DIRECTORY and
@@ -242,24 +489,15 @@ class JinjaRenderer():
 
   def __init__(self) -> None:
     self.config = get_config()
-
-    self.loader = CustomFunctionLoader(self._get_source, self._get_rendered, self._list_templates)
-    self.env = Environment(extensions=[RawIncludeExtension,
-                                       FileListExtension,
-                                       IncludeMapExtension,
-                                       RawIncludeMapExtension,
-                                       IncludeListExtension,
-                                       RawIncludeListExtension,
-                                       DigExtension,
-                                       'jinja2_ansible_filters.AnsibleCoreFiltersExtension'],
-                           loader=self.loader,
-                           undefined=StrictUndefined,
-                           finalize=self._finalize)
+    self.env = _shared_environment.env
+    _shared_environment.set_cache_dir(self.config.cache_dir)
 
     self.viewer = None
     self.template_vars = {}
     # Use a non-path sentinel so coverage doesn't think this is a file on disk
     self.template_origin = '<Unknown>'
+    # output of directory-expanding tags, by tag arguments and template vars
+    self._expansions: dict[tuple, tuple[Mapping, str]] = {}
 
     self._unresolved_re = re.compile(re.escape(self.config.cli_params.var_identifier) + r'\{[^}]+\}')
 
@@ -272,19 +510,23 @@ class JinjaRenderer():
 
     return value
 
-  def _get_source(self, path: str):
+  def _go_to_text(self, path: str) -> ScopedViewer:
     if not self.viewer:
       raise InternalError("Resource viewer is not set")
 
     target = self.viewer.go_to(os.path.normpath(path))
+    if target.is_binary:
+      log.warning(f'File {target.path} is not a text file, cannot read content')
+
+    return target
+
+  def _get_source(self, path: str):
+    target = self._go_to_text(path)
 
     return (target.content, path, None)
 
   def _get_rendered(self, path: str):
-    if not self.viewer:
-      raise InternalError("Resource viewer is not set")
-
-    target = self.viewer.go_to(os.path.normpath(path))
+    target = self._go_to_text(path)
 
     return (self.render(target.content), path, None)
 
@@ -295,7 +537,34 @@ class JinjaRenderer():
     return list(self.viewer.search_subresources(resource_types=self.file_types,
                                                 search_subdirs=[os.path.normpath(path)]))
 
-  def set_template_vars(self, template_vars: dict) -> None:
+  def memoize_expansion(self, key: tuple, build: Callable[[], str]) -> str:
+    """
+    Output of a directory-expanding tag, built once per renderer (i.e. per application) for the
+    same arguments and template vars, as the rendered `.j2` children depend on the vars.
+    """
+    vars_ = self.template_vars
+    key = (id(vars_),) + key
+    entry = self._expansions.get(key)
+    # the vars are kept in the entry so that their id cannot be reused by other vars
+    if entry is not None and entry[0] is vars_:
+      return entry[1]
+
+    result = build()
+    self._expansions[key] = (vars_, result)
+
+    return result
+
+  def memoize_raw_expansion(self, tag: str, path: str, build: Callable[[], str]) -> str:
+    """
+    Output of a raw directory-expanding tag, which depends on files only, so it is shared
+    by all renderers (i.e. applications) reading the same directory of the source tree.
+    """
+    if not self.viewer:
+      raise InternalError("Resource viewer is not set")
+
+    return self.viewer.memoize((tag, os.path.normpath(os.path.join(self.viewer.path, path))), build)
+
+  def set_template_vars(self, template_vars: Mapping) -> None:
     self.template_vars = template_vars
 
   def set_template_origin(self, origin: str) -> None:
@@ -305,8 +574,9 @@ class JinjaRenderer():
     self.viewer = viewer
 
   def render(self, content: str) -> str:
+    token = _current_renderer.set(self)
     try:
-      template = self.env.from_string(content)
+      template = _shared_environment.get_template(content, self.template_origin)
       template.filename = self.template_origin
 
       rendered = template.render(self.template_vars)
@@ -318,5 +588,7 @@ class JinjaRenderer():
       raise UndefinedTemplateVariableError('<unknown>', f'Likely an undefined variable in template `{self.template_origin}`') from None
     except jinja2.exceptions.TemplateSyntaxError as e:
       raise InternalError(f'Syntax error: {e.message} at line {e.lineno}') from None
+    finally:
+      _current_renderer.reset(token)
 
     return rendered
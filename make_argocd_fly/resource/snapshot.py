@@ -0,0 +1,248 @@
+import logging
+import os
+import time
+import mmap
+import pickle
+import hashlib
+import threading
+from typing import Callable, Any
+from importlib.metadata import version, PackageNotFoundError
+
+from make_argocd_fly.util import get_module_name
+
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 3
+# files modified this close to the moment they were read may change again within
+# the same mtime tick without changing their key, so they are not persisted
+RACY_WINDOW_NS = 2 * 10**9
+# stored contents are compacted into one segment once there are more segments
+SEGMENTS_MAX = 16
+
+
+def tool_version() -> str:
+  '''Installed package version, used to invalidate caches written by other versions.'''
+  try:
+    return version(get_module_name())
+  except PackageNotFoundError:
+    return 'unknown'
+
+
+def stat_key(st: os.stat_result) -> tuple[int, int, int]:
+  return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def load_cache_file(path: str) -> Any | None:
+  '''Data saved by `save_cache_file`, None if the file is missing, unreadable or written by another version.'''
+  try:
+    with open(path, 'rb') as f:
+      data = pickle.load(f)
+  except FileNotFoundError:
+    return None
+  except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+    log.debug(f'Ignoring unreadable cache file {path}: {e}')
+    return None
+
+  if not isinstance(data, dict) or data.get('version') != (FORMAT_VERSION, tool_version()):
+    log.debug(f'Ignoring cache file {path} written by another version')
+    return None
+
+  return data.get('data')
+
+
+def save_cache_file(path: str, data: Any) -> None:
+  '''Atomically write `data` to `path`, tagged with the current version.'''
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = f'{path}.{os.getpid()}'
+  with open(tmp_path, 'wb') as f:
+    pickle.dump({'version': (FORMAT_VERSION, tool_version()), 'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tmp_path, path)
+
+
+class Snapshot:
+  """
+  On-disk record of file contents read by a ResourceViewer, keyed by path and
+  (mtime, size, inode). Files whose key did not change since the previous run
+  are served from the snapshot instead of being read again.
+  Only the entries and the locations of contents are loaded up front. Contents are
+  stored by digest in segment files next to the snapshot, which are never changed once
+  written, and read when their entry is looked up, so a partial run pays for the files
+  it reads only. Identical contents are stored once; binary files are recorded without
+  content.
+  """
+  def __init__(self, path: str) -> None:
+    self.path = path
+    self.contents_dir = f'{path}.d'
+    self._entries: dict[str, tuple[tuple[int, int, int], str | None]] = {}
+    # (segment, offset, length) of the stored contents, by digest
+    self._locations: dict[str, tuple[str, int, int]] = {}
+    # contents read from the source files in this run, by digest
+    self._contents: dict[str, str] = {}
+    self._seen: dict[str, tuple[tuple[int, int, int], str | None]] = {}
+    self._racy: set[str] = set()
+    # segments are mapped on first read, from several threads when the tree is built in parallel
+    self._segments: dict[str, mmap.mmap | bytes | None] = {}
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  @classmethod
+  def load(cls, path: str) -> 'Snapshot':
+    snapshot = cls(path)
+
+    data = load_cache_file(path)
+    if not isinstance(data, dict):
+      return snapshot
+
+    snapshot._entries = data['entries']
+    snapshot._locations = data['locations']
+    log.debug(f'Loaded snapshot {path} with {len(snapshot._entries)} entries')
+
+    return snapshot
+
+  def _segment(self, name: str) -> mmap.mmap | bytes | None:
+    with self._lock:
+      if name not in self._segments:
+        try:
+          with open(os.path.join(self.contents_dir, name), 'rb') as f:
+            # empty files (of empty contents only) cannot be mapped
+            empty = os.fstat(f.fileno()).st_size == 0
+            self._segments[name] = b'' if empty else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+          log.debug(f'Ignoring unreadable snapshot segment {name}: {e}')
+          self._segments[name] = None
+
+      return self._segments[name]
+
+  def _load_content(self, digest: str) -> str | None:
+    location = self._locations.get(digest)
+    if location is None:
+      return None
+
+    name, offset, length = location
+    segment = self._segment(name)
+    if segment is None:
+      return None
+
+    try:
+      if offset + length > len(segment):
+        raise ValueError('segment is truncated')
+      return segment[offset:offset + length].decode()
+    except (ValueError, UnicodeDecodeError) as e:
+      log.debug(f'Ignoring unreadable snapshot segment {name}: {e}')
+      with self._lock:
+        self._segments[name] = None
+      return None
+
+  def _close_segments(self) -> None:
+    with self._lock:
+      for segment in self._segments.values():
+        if isinstance(segment, mmap.mmap):
+          segment.close()
+      self._segments.clear()
+
+  def _save_segment(self, contents: dict[str, str]) -> None:
+    """Write `contents` into a new segment and record where each of them is."""
+    data = [content.encode() for content in contents.values()]
+    name = hashlib.sha256(''.join(contents).encode()).hexdigest()
+    path = os.path.join(self.contents_dir, name)
+
+    tmp_path = f'{path}.{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+      f.writelines(data)
+    os.replace(tmp_path, path)
+
+    offset = 0
+    for digest, encoded in zip(contents, data):
+      self._locations[digest] = (name, offset, len(encoded))
+      offset += len(encoded)
+
+  def read(self, path: str, read_file: Callable[[str], str | None]) -> str | None:
+    """
+    Return the content of the file at `path`, from the snapshot if its key is unchanged,
+    otherwise from `read_file` (None for binary files).
+    """
+    key = stat_key(os.stat(path))
+
+    entry = self._entries.get(path)
+    if entry is not None and entry[0] == key:
+      content = None if entry[1] is None else self._load_content(entry[1])
+      if entry[1] is None or content is not None:
+        self.hits += 1
+        self._seen[path] = entry
+        return content
+
+    self.misses += 1
+    content = read_file(path)
+
+    digest = None
+    if content is not None:
+      digest = hashlib.sha256(content.encode()).hexdigest()
+      self._contents[digest] = content
+    self._seen[path] = (key, digest)
+    if time.time_ns() - key[0] < RACY_WINDOW_NS:
+      self._racy.add(path)
+
+    return content
+
+  def _compact(self, digests: set[str]) -> bool:
+    """Whether the stored contents of `digests` should be rewritten into a single segment."""
+    live = [self._locations[digest] for digest in digests if digest in self._locations]
+    segments = {name for name, _, _ in live}
+    stored = 0
+    for name in segments:
+      try:
+        stored += os.path.getsize(os.path.join(self.contents_dir, name))
+      except OSError:
+        pass
+
+    return len(segments) > SEGMENTS_MAX or stored > 2 * sum(length for _, _, length in live)
+
+  def _content(self, digest: str) -> str | None:
+    content = self._contents.get(digest)
+    return content if content is not None else self._load_content(digest)
+
+  def save(self, prune: bool = True) -> None:
+    """
+    Write entries seen in this run to disk, and contents read from the source files into
+    a new segment. With `prune=False` entries of the previous snapshot that were not seen
+    (e.g. outside of a partial run) are kept as well. Segments no entry refers to are
+    removed, and the contents are compacted into one segment once most of the stored
+    bytes are unused or there are too many segments.
+    """
+    entries = {} if prune else dict(self._entries)
+    entries.update(self._seen)
+    for path in self._racy:
+      entries.pop(path, None)
+
+    # contents of segments that could not be read are stored again, from this run's reads
+    broken = {name for name, segment in self._segments.items() if segment is None}
+    self._locations = {digest: location for digest, location in self._locations.items() if location[0] not in broken}
+
+    digests = {digest for _, digest in entries.values() if digest is not None}
+    if self._compact(digests):
+      contents = {digest: self._content(digest) for digest in sorted(digests)}
+      self._locations = {}
+    else:
+      contents = {digest: self._contents.get(digest) for digest in sorted(digests - self._locations.keys())}
+    contents = {digest: content for digest, content in contents.items() if content is not None}
+    self._close_segments()
+
+    os.makedirs(self.contents_dir, exist_ok=True)
+    if contents:
+      self._save_segment(contents)
+    # entries whose content could not be kept are read again next time
+    entries = {path: entry for path, entry in entries.items() if entry[1] is None or entry[1] in self._locations}
+    self._locations = {digest: location for digest, location in self._locations.items() if digest in digests}
+    save_cache_file(self.path, {'entries': entries, 'locations': self._locations})
+
+    segments = {name for name, _, _ in self._locations.values()}
+    for name in os.listdir(self.contents_dir):
+      if name not in segments:
+        try:
+          os.remove(os.path.join(self.contents_dir, name))
+        except OSError as e:
+          log.debug(f'Cannot remove snapshot segment {name}: {e}')
+
+    log.debug(f'Saved snapshot {self.path} with {len(entries)} entries ({self.hits} reused, {self.misses} read)')
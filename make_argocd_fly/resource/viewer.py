@@ -1,11 +1,19 @@
 import logging
 import os
+import io
+import sys
 import re
-from typing import Generator, Iterable
+import heapq
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Generator, Iterable, Hashable, Callable, Any
 from enum import StrEnum, auto
 
 from make_argocd_fly.exception import PathDoesNotExistError
-from make_argocd_fly.util import is_match
+from make_argocd_fly.util import PathMatcher
+from make_argocd_fly.resource.snapshot import Snapshot
 
 log = logging.getLogger(__name__)
 
@@ -23,56 +31,326 @@ EXTENSION_MAP = {
 }
 
 TEMPLATE_EXTENSIONS = {'.j2'}
+# same heuristic as git: a NUL byte near the start of a file means binary
+BINARY_SNIFF_SIZE = 8000
 
 
-def _get_resource_params(path: str) -> tuple[ResourceType, bool]:
+def _get_name_params(name: str) -> tuple[ResourceType, bool]:
   template = False
 
-  if not os.path.exists(path):
-    return ResourceType.DOES_NOT_EXIST, template
-  if os.path.isdir(path):
-    return ResourceType.DIRECTORY, template
-
-  path_wo_ext, ext = os.path.splitext(path)
+  name_wo_ext, ext = os.path.splitext(name)
   if ext in TEMPLATE_EXTENSIONS:
     template = True
-    _, ext = os.path.splitext(path_wo_ext)
+    _, ext = os.path.splitext(name_wo_ext)
 
   return EXTENSION_MAP.get(ext, ResourceType.UNKNOWN), template
 
 
+def _get_resource_params(path: str) -> tuple[ResourceType, bool]:
+  if not os.path.exists(path):
+    return ResourceType.DOES_NOT_EXIST, False
+  if os.path.isdir(path):
+    return ResourceType.DIRECTORY, False
+
+  return _get_name_params(path)
+
+
+def _get_entry_params(entry: os.DirEntry) -> tuple[ResourceType, bool]:
+  """Same as `_get_resource_params`, but reuses the file type returned by `os.scandir`."""
+  if entry.is_dir():
+    return ResourceType.DIRECTORY, False
+  if entry.is_file():
+    return _get_name_params(entry.name)
+
+  # broken symlinks and special files are rare, let the generic path handle them
+  return _get_resource_params(entry.path)
+
+
+def _read_text(path: str) -> str | None:
+  """Read a text file, None if the file is binary."""
+  with open(path, 'rb') as f:
+    if b'\0' in f.read(BINARY_SNIFF_SIZE):
+      return None
+
+    f.seek(0)
+    try:
+      with io.TextIOWrapper(f) as text:
+        return text.read()
+    except UnicodeDecodeError:
+      return None
+
+
+class _SubtreeIndex:
+  """
+  Flat pre-order listing of everything below a node (the node itself excluded).
+  Positions are bucketed by (resource type, template flag, depth) so that searches
+  only visit candidates of the requested kind; `ends[pos]` is the position right
+  after the subtree of `pos`, so any subdirectory maps to a contiguous range.
+  """
+  __slots__ = ('nodes', 'rel_paths', 'depths', 'ends', 'positions', 'buckets')
+
+  def __init__(self, root: 'ResourceViewer') -> None:
+    self.nodes: list[ResourceViewer] = []
+    self.rel_paths: list[str] = []
+    self.depths: list[int] = []
+    self.ends: list[int] = []
+    self.positions: dict[str, int] = {}
+    self.buckets: dict[tuple[ResourceType, bool, int], list[int]] = defaultdict(list)
+
+    self._add_children(root, '', 1)
+
+  def _add_children(self, node: 'ResourceViewer', prefix: str, depth: int) -> None:
+    for name, child in node._iter_children():
+      pos = len(self.nodes)
+      rel_path = os.path.join(prefix, name) if prefix else name
+
+      self.nodes.append(child)
+      self.rel_paths.append(rel_path)
+      self.depths.append(depth)
+      self.ends.append(pos + 1)
+      self.positions[rel_path] = pos
+      self.buckets[(child.resource_type, child.template, depth)].append(pos)
+
+      if child.resource_type == ResourceType.DIRECTORY:
+        self._add_children(child, rel_path, depth + 1)
+        self.ends[pos] = len(self.nodes)
+
+  def _select(self,
+              resource_types: list[ResourceType] | None,
+              template: bool | None,
+              depth: int,
+              ranges: list[tuple[int, int]],
+              base_depth: int) -> Iterable[int]:
+    candidates = []
+    for (resource_type, is_template, node_depth), bucket in self.buckets.items():
+      if ((resource_types is None or resource_type in resource_types) and
+          (template is None or is_template == template) and
+          node_depth > base_depth and (depth == -1 or node_depth - base_depth <= depth)):
+        for start, end in ranges:
+          candidates.append(bucket[bisect_left(bucket, start):bisect_left(bucket, end)])
+
+    return heapq.merge(*candidates)
+
+  def prune(self,
+            excludes: PathMatcher,
+            prefix: str,
+            depth: int,
+            start: int,
+            end: int,
+            base_depth: int) -> list[tuple[int, int]]:
+    """Split [start, end) around the subtrees of directories that `excludes` matches as a whole."""
+    ranges = []
+    for pos in self._select([ResourceType.DIRECTORY], None, depth, [(start, end)], base_depth):
+      if pos < start:
+        # inside a subtree that is already dropped
+        continue
+
+      if excludes.matches_subtree(prefix + self.rel_paths[pos]):
+        log.debug('Excluding %s', prefix + self.rel_paths[pos])
+        ranges.append((start, pos))
+        start = self.ends[pos]
+    ranges.append((start, end))
+
+    return ranges
+
+  def search(self,
+             resource_types: list[ResourceType] | None,
+             template: bool | None,
+             regex: re.Pattern,
+             depth: int,
+             ranges: list[tuple[int, int]],
+             base_depth: int = 0) -> Generator[int, None, None]:
+    """Yield positions within `ranges` matching the filters, in pre-order; depth is relative to `base_depth`."""
+    for pos in self._select(resource_types, template, depth, ranges, base_depth):
+      if regex.search(self.nodes[pos].name):
+        yield pos
+
+
+class _TreeOptions:
+  """Settings shared by all nodes of one tree."""
+  __slots__ = ('root_path', 'snapshot', 'lock', 'memo')
+
+  def __init__(self, root_path: str, snapshot: Snapshot | None) -> None:
+    self.root_path = root_path
+    self.snapshot = snapshot
+    # guards directories listed and indexes built on first access, as templates may be
+    # rendered on several threads; reentrant since building an index lists directories
+    self.lock = threading.RLock()
+    # values derived from the tree by its users, see ScopedViewer.memoize
+    self.memo: dict[Hashable, Any] = {}
+
+
 class ResourceViewer:
-  def __init__(self, path: str) -> None:
-    self.path = os.path.normpath(path)
-    self.name = os.path.basename(path)
+  """
+  In-memory tree of a directory on disk.
+  With `max_workers > 1` directory listings and file reads run on a thread pool;
+  the resulting tree is the same.
+  With `scope` only the listed subtrees (relative paths) are built up front; every
+  other directory is listed the first time its children are accessed and its files
+  are read on first access.
+  With `snapshot` file content is served from the snapshot when the file did not change.
+
+  Nodes are kept small as trees can have tens of thousands of them: settings are
+  shared per tree, paths are derived from the parent and names are interned.
+  """
+  __slots__ = ('name', 'resource_type', 'template', '_parent', '_children', '_tree', '_content', '_binary', '_index')
+
+  def __init__(self,
+               path: str,
+               max_workers: int = 1,
+               scope: Iterable[str] | None = None,
+               snapshot: Snapshot | None = None) -> None:
+    path = os.path.normpath(path)
+    self._init_node(os.path.basename(path), None, _TreeOptions(path, snapshot), _get_resource_params(path))
+
+    targets = [self] if scope is None else [node for node in map(self._find_on_disk, scope) if node is not None]
+    for target in targets:
+      if max_workers > 1:
+        target._build_parallel(max_workers)
+      else:
+        target._build()
+
+  def _init_node(self,
+                 name: str,
+                 parent: 'ResourceViewer | None',
+                 tree: _TreeOptions,
+                 resource_params: tuple[ResourceType, bool]) -> None:
+    self.name = name
+    self.resource_type, self.template = resource_params
+
+    self._parent = parent
+    # None until the directory is listed
+    self._children: dict[str, ResourceViewer] | None = None
+    self._tree = tree
+    self._content: str | None = None
+    self._binary: bool | None = None
+    self._index: _SubtreeIndex | None = None
+
+    log.debug('Created element (%s)', self)
 
-    self.resource_type = ResourceType.DOES_NOT_EXIST
-    self.template = False
-    self.content = ''
-    self.children = {}
+  @property
+  def path(self) -> str:
+    if self._parent is None:
+      return self._tree.root_path
 
-    self._build()
+    return os.path.join(self._parent.path, self.name)
+
+  @property
+  def children(self) -> dict[str, 'ResourceViewer']:
+    if self._children is None:
+      if self.resource_type != ResourceType.DIRECTORY:
+        return {}
+      with self._tree.lock:
+        if self._children is None:
+          self._add_children(self._scandir())
+
+    return self._children
+
+  def _is_scanned(self) -> bool:
+    return self._children is not None or self.resource_type != ResourceType.DIRECTORY
+
+  def _make_child(self, entry: os.DirEntry) -> 'ResourceViewer':
+    child = ResourceViewer.__new__(ResourceViewer)
+    child._init_node(sys.intern(entry.name), self, self._tree, _get_entry_params(entry))
+
+    return child
+
+  def _add_children(self, entries: list[os.DirEntry]) -> None:
+    self._children = {entry.name: self._make_child(entry) for entry in entries}
+
+  def _scandir(self) -> list[os.DirEntry]:
+    # sorted so that the tree (and everything derived from it) does not depend on the filesystem order
+    with os.scandir(self.path) as it:
+      return sorted(it, key=lambda entry: entry.name)
+
+  def _find_on_disk(self, path: str) -> 'ResourceViewer | None':
+    """Like `_go_to`, but lists only the directories along `path` and returns None if it does not exist."""
+    try:
+      return self._go_to(path)
+    except PathDoesNotExistError:
+      return None
+
+  def _needs_read(self) -> bool:
+    return self.resource_type not in (ResourceType.DIRECTORY, ResourceType.DOES_NOT_EXIST) and self._content is None
 
   def _build(self) -> None:
-    self.resource_type, self.template = _get_resource_params(self.path)
     if self.resource_type == ResourceType.DIRECTORY:
-      for child_name in os.listdir(self.path):
-        self.children[child_name] = ResourceViewer(os.path.join(self.path, child_name))
-        self.children[child_name].children['..'] = self
-    elif self.resource_type != ResourceType.DOES_NOT_EXIST:
-      try:
-        with open(self.path) as f:
-          self.content = ''.join(f.readlines())
-      except UnicodeDecodeError:
-        log.warning(f'File {self.path} is not a text file, cannot read content')
-
-    log.debug(f'Created element ({self})')
+      for _, child in self._iter_children():
+        child._build()
+    elif self._needs_read():
+      self._content = self._read_content()
+
+  def _build_parallel(self, max_workers: int) -> None:
+    pending: dict[Future, ResourceViewer] = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='viewer') as executor:
+      def schedule(node: ResourceViewer) -> None:
+        if not node._is_scanned():
+          pending[executor.submit(node._scandir)] = node
+        elif node.resource_type == ResourceType.DIRECTORY:
+          for _, child in node._iter_children():
+            schedule(child)
+        elif node._needs_read():
+          pending[executor.submit(node._read_content)] = node
+
+      schedule(self)
+      while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          node = pending.pop(future)
+          if node.resource_type == ResourceType.DIRECTORY:
+            node._add_children(future.result())
+            schedule(node)
+          else:
+            node._content = future.result()
+
+  def _read_content(self) -> str:
+    if self.resource_type in (ResourceType.DIRECTORY, ResourceType.DOES_NOT_EXIST):
+      return ''
+
+    path = self.path
+    if self._tree.snapshot is not None:
+      content = self._tree.snapshot.read(path, _read_text)
+    else:
+      content = _read_text(path)
+
+    self._binary = content is None
+    if self._binary:
+      log.debug(f'File {path} is binary, content is not loaded')
+      return ''
+
+    return content
+
+  @property
+  def content(self) -> str:
+    if self._content is not None:
+      return self._content
+
+    self._content = self._read_content()
+
+    return self._content
+
+  @property
+  def is_binary(self) -> bool:
+    if self._binary is None:
+      # not read yet
+      self.content
+
+    return bool(self._binary)
 
   def _go_to(self, path: str) -> 'ResourceViewer':
-    parts = os.path.normpath(path).split(os.sep)
+    path = os.path.normpath(path)
+    if self._index is not None and path in self._index.positions:
+      return self._index.nodes[self._index.positions[path]]
+
+    parts = path.split(os.sep)
     current = self
 
     for part in parts:
+      if part == '..' and current._parent is not None:
+        current = current._parent
+        continue
+
       if part not in current.children:
         raise PathDoesNotExistError(path)
 
@@ -81,61 +359,70 @@ class ResourceViewer:
     return current
 
   def _iter_children(self):
-    """Yield (name, node) for children excluding the parent backlink '..'."""
-    for name, node in self.children.items():
-      if name == '..':
-        continue
-      yield name, node
+    """Return (name, node) pairs of the children."""
+    return self.children.items()
+
+  def _get_index(self) -> _SubtreeIndex:
+    if self._index is None:
+      with self._tree.lock:
+        if self._index is None:
+          self._index = _SubtreeIndex(self)
+
+    return self._index
 
   def _search_subresources(self,
                            resource_types: list[ResourceType] | None = None,
                            template: bool | None = None,
                            name_pattern: str = r'.*',
                            search_subdirs: list[str] | None = None,
-                           depth: int = -1) -> Generator['ResourceViewer', None, None]:
+                           depth: int = -1,
+                           excludes: PathMatcher | None = None,
+                           prefix: str = '') -> Generator[tuple[str, 'ResourceViewer'], None, None]:
     """
-    Yield children matching filters. If search_subdirs is provided, treat each
-    item as a path relative to `self` ('.' allowed). Depth: -1 means unlimited.
+    Yield (`prefix` + path relative to `self`, node) for children matching filters.
+    If search_subdirs is provided, treat each item as a path relative to `self`
+    ('.' allowed). Depth: -1 means unlimited.
+    `excludes` is matched against the yielded path; directories it matches as a
+    whole are not descended into.
     """
     if self.resource_type == ResourceType.DOES_NOT_EXIST:
       raise PathDoesNotExistError(self.path)
 
-    # If specific subdirs requested, delegate to each target and stop here.
-    if search_subdirs is not None:
-      for subdir in search_subdirs:
-        try:
-          target = self if subdir == '.' else self._go_to(subdir)
-        except PathDoesNotExistError:
-          continue
-        # Recurse from that subdir with the same filters, but without search_subdirs
-        yield from target._search_subresources(resource_types=resource_types,
-                                               template=template,
-                                               name_pattern=name_pattern,
-                                               search_subdirs=None,
-                                               depth=depth)
-      return
-
+    index = self._get_index()
     regex = re.compile(name_pattern)
 
-    for _, child in self._iter_children():
-        # Apply filters for the child itself
-        if ((resource_types is None or child.resource_type in resource_types) and
-            (template is None or child.template == template) and
-            regex.search(child.name) and
-            (depth == -1 or depth > 0)):
-          yield child
-
-        # Recurse into directories if depth allows
-        if child.resource_type == ResourceType.DIRECTORY and (depth == -1 or depth > 0):
-          next_depth = (depth - 1) if depth > 0 else -1
-          yield from child._search_subresources(resource_types=resource_types,
-                                                template=template,
-                                                name_pattern=name_pattern,
-                                                search_subdirs=None,
-                                                depth=next_depth)
+    for subdir in (['.'] if search_subdirs is None else search_subdirs):
+      subdir = os.path.normpath(subdir)
+
+      if subdir == '.':
+        search_range = (0, len(index.nodes), 0)
+      elif subdir in index.positions:
+        pos = index.positions[subdir]
+        if index.nodes[pos].resource_type == ResourceType.DOES_NOT_EXIST:
+          raise PathDoesNotExistError(index.nodes[pos].path)
+        search_range = (pos + 1, index.ends[pos], index.depths[pos])
+      else:
+        # paths leaving the subtree (e.g. '../common') are searched from their own node; the
+        # prefix follows where it is, as the path may come back into the scope (e.g. '../app/base')
+        target = self._find_on_disk(subdir)
+        if target is not None:
+          target_prefix = os.path.normpath(os.path.join(prefix, os.path.relpath(target.path, self.path)))
+          yield from target._search_subresources(resource_types, template, name_pattern, None, depth,
+                                                 excludes, '' if target_prefix == '.' else target_prefix + os.sep)
+        continue
+
+      start, end, base_depth = search_range
+      ranges = index.prune(excludes, prefix, depth, start, end, base_depth) if excludes else [(start, end)]
+      for pos in index.search(resource_types, template, regex, depth, ranges, base_depth):
+        rel_path = prefix + index.rel_paths[pos]
+        if excludes and excludes.match(rel_path):
+          log.debug('Excluding %s', rel_path)
+          continue
+
+        yield rel_path, index.nodes[pos]
 
   def scoped(self) -> "ScopedViewer":
-    return ScopedViewer(self, base_path=self.path)
+    return ScopedViewer(self, base_path=self.path, rel_path='.')
 
   def __str__(self) -> str:
     return f'{self.__class__.__name__}({self.path}) of type {self.resource_type}'
@@ -145,12 +432,15 @@ class ScopedViewer:
   """
   Immutable, lightweight view over a ResourceViewer subtree.
   rel_path is computed relative to base_path, not the global source root.
+  Views created by navigation and searches get their rel_path precomputed
+  from the parent view; otherwise it is computed once on first access.
   """
-  __slots__ = ("_node", "_base_path")
+  __slots__ = ("_node", "_base_path", "_rel_path")
 
-  def __init__(self, node: "ResourceViewer", base_path: str | None = None) -> None:
+  def __init__(self, node: "ResourceViewer", base_path: str | None = None, rel_path: str | None = None) -> None:
     self._node = node
     self._base_path = os.path.normpath(base_path or node.path)
+    self._rel_path = rel_path
 
   @property
   def path(self) -> str:
@@ -172,19 +462,34 @@ class ScopedViewer:
   def content(self) -> str:
     return self._node.content
 
+  @property
+  def is_binary(self) -> bool:
+    return self._node.is_binary
+
   @property
   def rel_path(self) -> str:
-    rel = os.path.relpath(self._node.path, self._base_path)
-    return "." if rel == "." else os.path.normpath(rel)
+    if self._rel_path is None:
+      self._rel_path = os.path.normpath(os.path.relpath(self._node.path, self._base_path))
+
+    return self._rel_path
+
+  def _join_rel_path(self, path: str, node: "ResourceViewer") -> str:
+    path = os.path.normpath(path)
+    if path == os.pardir or path.startswith(os.pardir + os.sep) or os.path.isabs(path):
+      # the path leaves this view and may come back into it (e.g. '../app/base'), so the
+      # node's own path tells where it is
+      return os.path.normpath(os.path.relpath(node.path, self._base_path))
+
+    return os.path.normpath(os.path.join(self.rel_path, path))
 
   def go_to(self, path: str, rebase: bool = True) -> "ScopedViewer":
     nxt = self._node._go_to(path)
     if rebase:
       # Navigate and make the target the new '.'
-      return ScopedViewer(nxt, base_path=nxt.path)
+      return ScopedViewer(nxt, base_path=nxt.path, rel_path='.')
     else:
       # Keep the original base path
-      return ScopedViewer(nxt, base_path=self._base_path)
+      return ScopedViewer(nxt, base_path=self._base_path, rel_path=self._join_rel_path(path, nxt))
 
   def search_subresources(self,
                           resource_types: list["ResourceType"] | None = None,
@@ -198,34 +503,33 @@ class ScopedViewer:
     Delegate to the underlying node but re-wrap yielded children in this scope.
     `search_subdirs` remain relative to this scope (same as underlying semantics).
     `excludes` / `includes` are POSIX-like relative patterns (prefix or glob),
-    matched against this scope's `rel_path`.
+    matched against this scope's `rel_path`. Excluded directories are not descended into.
     """
 
-    exclude_patterns = list(excludes or [])
-    include_patterns = list(includes or [])
-
-    for child in self._node._search_subresources(resource_types=resource_types,
-                                                 template=template,
-                                                 name_pattern=name_pattern,
-                                                 search_subdirs=search_subdirs,
-                                                 depth=depth):
-      scoped = ScopedViewer(child, base_path=self._base_path)
-
-      if exclude_patterns and is_match(scoped.rel_path, exclude_patterns):
-        log.debug('Excluding %s', scoped.rel_path)
-        continue
-
-      if include_patterns and not is_match(scoped.rel_path, include_patterns):
+    exclude_matcher = PathMatcher(excludes or [])
+    include_matcher = PathMatcher(includes or [])
+
+    prefix = self.rel_path
+    for rel_path, child in self._node._search_subresources(resource_types=resource_types,
+                                                           template=template,
+                                                           name_pattern=name_pattern,
+                                                           search_subdirs=search_subdirs,
+                                                           depth=depth,
+                                                           excludes=exclude_matcher or None,
+                                                           prefix='' if prefix == '.' else prefix + os.sep):
+      if include_matcher and not include_matcher.match(rel_path):
         continue
 
-      yield scoped
+      yield ScopedViewer(child, base_path=self._base_path, rel_path=rel_path)
 
   def iter_children(self):
-    for _, child in self._node._iter_children():
-      yield ScopedViewer(child, base_path=self._base_path)
+    prefix = '' if self.rel_path == '.' else self.rel_path + os.sep
+    for name, child in self._node._iter_children():
+      yield ScopedViewer(child, base_path=self._base_path, rel_path=prefix + name)
 
   def child(self, name: str) -> "ScopedViewer":
-    return ScopedViewer(self._node._go_to(name), base_path=self._base_path)
+    node = self._node._go_to(name)
+    return ScopedViewer(node, base_path=self._base_path, rel_path=self._join_rel_path(name, node))
 
   def exists(self, path: str) -> bool:
     try:
@@ -234,9 +538,28 @@ class ScopedViewer:
     except PathDoesNotExistError:
       return False
 
+  def memoize(self, key: Hashable, build: Callable[[], Any]) -> Any:
+    """
+    Return `build()`, computed once per `key` for the whole tree (all scopes share it).
+    Meant for values derived from file names and contents, which do not change once read.
+    """
+    memo = self._node._tree.memo
+    try:
+      return memo[key]
+    except KeyError:
+      # not locked: a value built by two threads at once is built twice, the last one is kept
+      value = memo[key] = build()
+      return value
+
   def __str__(self) -> str:
     return f"{self.__class__.__name__}({self.path}, base={self._base_path})"
 
 
-def build_scoped_viewer(path: str) -> ScopedViewer:
-    return ResourceViewer(path).scoped()
+def build_scoped_viewer(path: str,
+                        max_workers: int = 1,
+                        scope: Iterable[str] | None = None,
+                        snapshot: Snapshot | None = None) -> ScopedViewer:
+    return ResourceViewer(path,
+                          max_workers=max_workers,
+                          scope=scope,
+                          snapshot=snapshot).scoped()
@@ -1,14 +1,23 @@
 from abc import ABC, abstractmethod
 import logging
 import os
+import shutil
 import yaml
 from yaml import SafeDumper
 from typing import Any, Final
 
 from make_argocd_fly.exception import InternalError
 
+try:
+  import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+  fcntl = None
+
 log = logging.getLogger(__name__)
 
+# _IOW(0x94, 9, int), exposed as fcntl.FICLONE only since Python 3.12
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+
 
 class YamlDumper(SafeDumper):
   def increase_indent(self, flow=False, *args, **kwargs):
@@ -52,6 +61,52 @@ class GenericWriter(AbstractWriter):
         f.write(data)
 
 
+def _clone_file(src_fd: int, dst_fd: int) -> bool:
+  '''Share the source extents with the destination (reflink), if the filesystem supports it.'''
+  if fcntl is None:
+    return False
+
+  try:
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    return True
+  except OSError:
+    return False
+
+
+def _copy_file_range(src_fd: int, dst_fd: int) -> bool:
+  '''Copy within the kernel, without passing the data through user space.'''
+  if not hasattr(os, 'copy_file_range'):
+    return False
+
+  try:
+    while os.copy_file_range(src_fd, dst_fd, 1 << 30):
+      pass
+    return True
+  except OSError:
+    # e.g. not supported for this pair of filesystems, the offsets tell where a fallback has to continue
+    return False
+
+
+class PassthroughWriter(AbstractWriter):
+  '''
+  Copies a source file as is, `data` is the path of the file to copy.
+  Used for files that are not rendered (e.g. binary files), so their content never goes through Python.
+  '''
+  def write(self, output_path: str, data: Any, env_name: str, app_name: str, origin: str) -> None:
+    if not isinstance(data, str):
+      raise InternalError(f'PassthroughWriter requires a source file path; got {type(data).__name__} from {origin}')
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    with open(data, 'rb') as fsrc, open(output_path, 'wb') as fdst:
+      if _clone_file(fsrc.fileno(), fdst.fileno()):
+        return
+      if _copy_file_range(fsrc.fileno(), fdst.fileno()):
+        return
+
+      shutil.copyfileobj(fsrc, fdst)
+
+
 class YamlWriter(AbstractWriter):
   '''
   Strict YAML writer: requires a parsed YAML mapping (dict) as input.
@@ -75,3 +130,4 @@ class YamlWriter(AbstractWriter):
 # Stateless singletons (safe to reuse across tasks)
 GENERIC_WRITER: Final[AbstractWriter] = GenericWriter()
 YAML_WRITER: Final[AbstractWriter] = YamlWriter()
+PASSTHROUGH_WRITER: Final[AbstractWriter] = PassthroughWriter()
@@ -1,6 +1,7 @@
 import logging
 import os
 from typing import Protocol, Iterable
+from collections.abc import Mapping
 from pprint import pformat
 from deprecated import deprecated
 
@@ -11,6 +12,7 @@ from make_argocd_fly import default
 from make_argocd_fly.param import ApplicationNameFormat
 from make_argocd_fly.config import get_config
 from make_argocd_fly.cliparam import get_cli_params
+from make_argocd_fly.type import WriterType
 
 
 log = logging.getLogger(__name__)
@@ -25,11 +27,11 @@ class Stage(Protocol):
 
 
 @deprecated(version='v0.4.4', reason='`--print-vars` is deprecated, use `--dump-context` instead')
-def print_vars_deprecated(app_name: str, env_name: str, vars_: dict) -> None:
-  log.info(f'Variables for application {app_name} in environment {env_name}:\n{pformat(vars_)}')
+def print_vars_deprecated(app_name: str, env_name: str, vars_: Mapping) -> None:
+  log.info(f'Variables for application {app_name} in environment {env_name}:\n{pformat(dict(vars_))}')
 
 
-def _resolve_template_vars(env_name: str, app_name: str) -> dict:
+def _resolve_template_vars(env_name: str, app_name: str) -> Mapping:
   config = get_config()
   params = config.get_params(env_name, app_name)
 
@@ -56,6 +58,22 @@ def _resolve_template_vars(env_name: str, app_name: str) -> dict:
   return vars_
 
 
+def _make_resource(child: ScopedViewer) -> Resource:
+  # binary files are not rendered, they are copied from the source on write
+  if child.resource_type != ResourceType.YAML and child.is_binary:
+    return Resource(resource_type=child.resource_type,
+                    data='',
+                    origin=child.rel_path,
+                    source_path=child.rel_path,
+                    writer_type=WriterType.PASSTHROUGH,
+                    source_file=child.path)
+
+  return Resource(resource_type=child.resource_type,
+                  data=child.content,
+                  origin=child.rel_path,
+                  source_path=child.rel_path)
+
+
 def _discover_resources(viewer: ScopedViewer,
                         resource_types: list[ResourceType],
                         *,
@@ -66,17 +84,14 @@ def _discover_resources(viewer: ScopedViewer,
                                           template=False,
                                           search_subdirs=search_subdirs,
                                           excludes=excludes):
-    out_resources.append(Resource(resource_type=child.resource_type,
-                                  data=child.content,
-                                  origin=child.rel_path,
-                                  source_path=child.rel_path))
+    out_resources.append(_make_resource(child))
 
   return out_resources
 
 
 def _discover_templated_resources(viewer: ScopedViewer,
                                   resource_types: list[ResourceType],
-                                  resolved_vars: dict,
+                                  resolved_vars: Mapping,
                                   *,
                                   search_subdirs: list[str] | None,
                                   excludes: Iterable[str] | None) -> list[TemplatedResource]:
@@ -106,17 +121,14 @@ def _discover_extra_resources(viewer: ScopedViewer,
                                           search_subdirs=search_subdirs,
                                           excludes=excludes,
                                           includes=includes):
-    out_extra_resources.append(Resource(resource_type=child.resource_type,
-                                        data=child.content,
-                                        origin=child.rel_path,
-                                        source_path=child.rel_path))
+    out_extra_resources.append(_make_resource(child))
 
   return out_extra_resources
 
 
 def _discover_templated_extra_resources(viewer: ScopedViewer,
                                         resource_types: list[ResourceType],
-                                        resolved_vars: dict,
+                                        resolved_vars: Mapping,
                                         *,
                                         search_subdirs: list[str] | None,
                                         excludes: Iterable[str] | None,
@@ -191,9 +191,9 @@ class DiscoverK8sHelmfileApplication:
     ctx_set(ctx, self.provides['output_dir'], config.runtime_output_dir)
 
 
-def _find_child_apps(config: Config, parent_app_name: str, parent_env_name: str) -> list[tuple[str, str]]:
-  """Return (env_name, app_name) pairs for all apps that declare parent_app_name as their parent."""
-  discovered = []
+def _index_child_apps(config: Config) -> dict[tuple[str, str], list[tuple[str, str]]]:
+  """Return (env_name, app_name) pairs of all apps that declare a parent, keyed by (parent_app_name, parent_env_name)."""
+  index: dict[tuple[str, str], list[tuple[str, str]]] = {}
   for env_name in config.list_envs():
     for app_name in config.list_apps(env_name):
       params = config.get_params(env_name, app_name)
@@ -201,16 +201,32 @@ def _find_child_apps(config: Config, parent_app_name: str, parent_env_name: str)
       if not params.parent_app:
         continue
 
-      parent_matches = params.parent_app == parent_app_name
-      env_matches = (
-        (params.parent_app_env is None and env_name == parent_env_name) or
-        (params.parent_app_env is not None and params.parent_app_env == parent_env_name)
-      )
+      parent_env_name = env_name if params.parent_app_env is None else params.parent_app_env
+      index.setdefault((params.parent_app, parent_env_name), []).append((env_name, app_name))
+
+  return index
+
+
+class _ChildAppsIndex:
+  """Index of child apps, built once per populated config and shared by all app-of-apps applications."""
+  def __init__(self) -> None:
+    self._built: tuple[Config, dict | None, dict[tuple[str, str], list[tuple[str, str]]]] | None = None
+
+  def get(self, config: Config) -> dict[tuple[str, str], list[tuple[str, str]]]:
+    built = self._built
+    if built is None or built[0] is not config or built[1] is not config.config:
+      built = (config, config.config, _index_child_apps(config))
+      self._built = built
 
-      if parent_matches and env_matches:
-        discovered.append((env_name, app_name))
+    return built[2]
 
-  return discovered
+
+_child_apps_index = _ChildAppsIndex()
+
+
+def _find_child_apps(config: Config, parent_app_name: str, parent_env_name: str) -> list[tuple[str, str]]:
+  """Return (env_name, app_name) pairs for all apps that declare parent_app_name as their parent."""
+  return list(_child_apps_index.get(config).get((parent_app_name, parent_env_name), []))
 
 
 class DiscoverK8sAppOfAppsApplication:
@@ -1,5 +1,6 @@
 import logging
 import os
+import asyncio
 import yaml
 import yaml.composer
 import yaml.parser
@@ -12,8 +13,9 @@ except ImportError:
   from yaml import SafeLoader
 
 from make_argocd_fly.context import Context, ctx_get, ctx_set, resolve_expr
-from make_argocd_fly.context.data import Resource
-from make_argocd_fly.resource.viewer import ResourceType
+from make_argocd_fly.context.data import Resource, TemplatedResource
+from make_argocd_fly.resource.viewer import ResourceType, ScopedViewer, build_scoped_viewer
+from make_argocd_fly.config import get_config
 from make_argocd_fly.exception import (UndefinedTemplateVariableError, TemplateRenderingError, InternalError,
                                        PathDoesNotExistError, OutputFilenameConstructionError)
 from make_argocd_fly.renderer import JinjaRenderer
@@ -21,41 +23,80 @@ from make_argocd_fly.util import extract_single_resource, get_app_rel_path, is_o
 from make_argocd_fly.namegen import (K8sInfo, SourceInfo, K8sPolicy, SourcePolicy, Deduper, RoutingRules,
                                      KUSTOMIZE_BASENAMES, HELMFILE_BASENAMES)
 from make_argocd_fly.type import PipelineType, NamingPolicyType, WriterType
+from make_argocd_fly.limits import RuntimeLimits
 
 
 log = logging.getLogger(__name__)
 
 
+def _render_templates(viewer: ScopedViewer | None, templated_resources: list[TemplatedResource],
+                      env_name: str, app_name: str) -> list[Resource]:
+  renderer = JinjaRenderer()
+  renderer.set_resource_viewer(viewer)
+  out_resources = []
+
+  for template in templated_resources:
+    renderer.set_template_vars(template.vars)
+    renderer.set_template_origin(template.origin)
+
+    try:
+      result = renderer.render(template.data)
+
+      out_resources.append(Resource(resource_type=template.resource_type,
+                                    data=result,
+                                    origin=template.origin,
+                                    source_path=template.source_path))
+    except (UndefinedTemplateVariableError, PathDoesNotExistError, InternalError) as e:
+      log.error(f'{e}')
+      raise TemplateRenderingError(template.origin, app_name, env_name, f'Error rendering template {template.origin}') from e
+
+  return out_resources
+
+
+# source tree of a render worker process, built on first use
+_process_viewer: ScopedViewer | None = None
+
+
+def _render_templates_in_process(viewer_path: str | None, templated_resources: list[TemplatedResource],
+                                 env_name: str, app_name: str) -> list[Resource]:
+  """Render in a worker process whose config is populated, the viewer is sent as its path only."""
+  global _process_viewer
+
+  viewer = None
+  if viewer_path is not None:
+    source_dir = os.path.normpath(get_config().source_dir)
+    if _process_viewer is None or _process_viewer.path != source_dir:
+      # directories are listed and files read as templates reach for them
+      _process_viewer = build_scoped_viewer(source_dir, scope=[])
+    viewer = _process_viewer.go_to(os.path.relpath(viewer_path, source_dir))
+
+  return _render_templates(viewer, templated_resources, env_name, app_name)
+
+
 class RenderTemplates:
   name = 'RenderTemplates'
 
-  def __init__(self, requires: dict[str, str], provides: dict[str, str]) -> None:
+  def __init__(self, requires: dict[str, str], provides: dict[str, str], *, limits: RuntimeLimits | None = None) -> None:
     self.requires = requires
     self.provides = provides
+    self.limits = limits
 
   async def run(self, ctx: Context) -> None:
     log.debug(f'Run {self.name} stage')
     templated_resources = ctx_get(ctx, self.requires['templated_resources'])
     viewer = ctx_get(ctx, self.requires['viewer'])
-
-    renderer = JinjaRenderer()
-    renderer.set_resource_viewer(viewer)
-    out_resources = []
-
-    for template in templated_resources:
-      renderer.set_template_vars(template.vars)
-      renderer.set_template_origin(template.origin)
-
-      try:
-        result = renderer.render(template.data)
-
-        out_resources.append(Resource(resource_type=template.resource_type,
-                                      data=result,
-                                      origin=template.origin,
-                                      source_path=template.source_path))
-      except (UndefinedTemplateVariableError, PathDoesNotExistError, InternalError) as e:
-        log.error(f'{e}')
-        raise TemplateRenderingError(template.origin, ctx.app_name, ctx.env_name, f'Error rendering template {template.origin}') from e
+    loop = asyncio.get_running_loop()
+
+    # Offload rendering so that other applications' subprocesses and writes keep going
+    if self.limits is not None and self.limits.render_process_executor is not None:
+      out_resources = await loop.run_in_executor(self.limits.render_process_executor, _render_templates_in_process,
+                                                 viewer.path if viewer is not None else None, templated_resources,
+                                                 ctx.env_name, ctx.app_name)
+    elif self.limits is not None and self.limits.render_executor is not None:
+      out_resources = await loop.run_in_executor(self.limits.render_executor, _render_templates,
+                                                 viewer, templated_resources, ctx.env_name, ctx.app_name)
+    else:
+      out_resources = _render_templates(viewer, templated_resources, ctx.env_name, ctx.app_name)
 
     ctx_set(ctx, self.provides['resources'], out_resources)
 
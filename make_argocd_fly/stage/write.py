@@ -6,7 +6,7 @@ from typing import Any
 from make_argocd_fly.context import Context, ctx_get, ctx_set
 from make_argocd_fly.context.data import Resource
 from make_argocd_fly.resource.viewer import ResourceType
-from make_argocd_fly.resource.writer import AbstractWriter, GENERIC_WRITER, YAML_WRITER
+from make_argocd_fly.resource.writer import AbstractWriter, GENERIC_WRITER, YAML_WRITER, PASSTHROUGH_WRITER
 from make_argocd_fly.exception import InternalError, KustomizeError, HelmfileError
 from make_argocd_fly.util import get_app_rel_path, remove_dir
 from make_argocd_fly.limits import RuntimeLimits
@@ -61,6 +61,9 @@ class WriteOnDisk:
           if resource.writer_type == WriterType.K8S_YAML:
             writer = YAML_WRITER
             payload = resource.yaml_obj
+          elif resource.writer_type == WriterType.PASSTHROUGH:
+            writer = PASSTHROUGH_WRITER
+            payload = resource.source_file
           else:
             writer = GENERIC_WRITER
             payload = resource.data
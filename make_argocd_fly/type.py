@@ -12,6 +12,7 @@ class PipelineType(StrEnum):
 class WriterType(StrEnum):
   GENERIC = auto()
   K8S_YAML = auto()
+  PASSTHROUGH = auto()
 
 
 class NamingPolicyType(StrEnum):
@@ -13,7 +13,7 @@ import urllib.request
 import urllib.error
 from typing import Iterable, Any
 from pathlib import PurePosixPath
-from collections.abc import Iterator
+from collections.abc import Iterator, Hashable, Mapping
 from importlib.metadata import version, PackageNotFoundError
 from packaging.version import Version
 
@@ -115,18 +115,97 @@ class VarsResolver:
 
     return self._iterate(copy.deepcopy(to_resolve), source, allow_unresolved=allow_unresolved)
 
+  def _iter_fields(self, value: str) -> Iterator[str]:
+    '''Yield references in `value` as format fields, e.g. `{a[b]}` for `${a[b]}`.'''
+    (var_start, var_end) = self._find_var_position(value)
+    while (var_start, var_end) != (-1, -1):
+      yield value[var_start:var_end + 1]
+      (var_start, var_end) = self._find_var_position(value, var_end + 1)
+
+  def _check_cycles(self, field: str, source: dict, stack: list[str], visited: set[str]) -> None:
+    '''
+    Depth-first walk of the references reachable from `field`: a reference points to the references
+    in the text it is substituted with. A cycle would make the resolution go on forever.
+    '''
+    if field in visited:
+      return
+    if field in stack:
+      cycle = ' -> '.join(f'{self.var_identifier}{f}' for f in stack[stack.index(field):] + [field])
+      raise ConfigFileError(f'Circular variable reference: {cycle}')
+
+    try:
+      text = field.format(**source)
+    except (KeyError, IndexError, AttributeError, TypeError, ValueError):
+      # unresolvable, reported (or kept) by the resolution itself
+      text = ''
+
+    stack.append(field)
+    for ref in self._iter_fields(text):
+      self._check_cycles(ref, source, stack, visited)
+    stack.pop()
+    visited.add(field)
+
+  def _resolve_graph(self, value: Any, source: dict, allow_unresolved: bool, memo: dict[str, Any], visited: set[str]) -> Any:
+    if isinstance(value, str):
+      if self.var_identifier not in value:
+        return value
+    elif isinstance(value, dict):
+      return {k: self._resolve_graph(v, source, allow_unresolved, memo, visited) for k, v in value.items()}
+    elif isinstance(value, list):
+      return [self._resolve_graph(v, source, allow_unresolved, memo, visited) for v in value]
+    elif isinstance(value, (int, float, type(None))):
+      return value
+    else:
+      return copy.deepcopy(value)
+
+    if value in memo:
+      return memo[value]
+
+    for field in self._iter_fields(value):
+      self._check_cycles(field, source, [], visited)
+
+    resolutions = self.resolution_counter
+    resolved = self._resolve_value(value, source, allow_unresolved=allow_unresolved)
+    if self.resolution_counter != resolutions:
+      # the substituted text may contain references of its own
+      resolved = self._resolve_graph(resolved, source, allow_unresolved, memo, visited)
+
+    # containers are rebuilt for every occurrence so that results never share objects
+    if not isinstance(resolved, (dict, list)):
+      memo[value] = resolved
+
+    return resolved
+
   @staticmethod
   def resolve_all(to_resolve: dict,
                   source: dict,
                   var_identifier: str = default.VAR_IDENTIFIER,
                   allow_unresolved: bool = False) -> dict:
+      '''
+      Resolve references until none can be resolved anymore. Gives the same result as repeating
+      `resolve` until it does no resolutions, but each distinct string is resolved only once and
+      reference cycles raise ConfigFileError instead of never finishing.
+      '''
       resolver = VarsResolver(var_identifier)
 
-      resolved_vars = resolver.resolve(to_resolve, source, allow_unresolved)
-      while resolver.get_resolutions() > 0:
-        resolved_vars = resolver.resolve(resolved_vars, source, allow_unresolved)
+      return resolver._resolve_graph(to_resolve, source, allow_unresolved, {}, set())
+
 
-      return resolved_vars
+def find_var_references(value: Any, var_identifier: str = default.VAR_IDENTIFIER) -> set[str]:
+  '''Top-level names referenced by variable references (e.g. `${a.b}` -> `a`) anywhere in `value`.'''
+  references = set()
+
+  if isinstance(value, dict):
+    for v in value.values():
+      references |= find_var_references(v, var_identifier)
+  elif isinstance(value, list):
+    for v in value:
+      references |= find_var_references(v, var_identifier)
+  elif isinstance(value, str):
+    for field in re.findall(re.escape(var_identifier) + r'\{([^}]*)\}', value):
+      references.add(re.match(r'[^.\[!:]*', field).group(0))
+
+  return references
 
 
 def extract_single_resource(multi_resource_yml: str | None) -> Iterator[str]:
@@ -146,6 +225,21 @@ def get_app_rel_path(env_name: str, app_name: str) -> str:
   return os.path.join(env_name, app_name)
 
 
+_LIST_FORM = object()
+_DICT_FORM = object()
+
+
+def _hashable_form(item: Any) -> Hashable:
+  '''Hashable stand-in for `item`, equal for two items exactly when the items are equal. Raises TypeError if there is none.'''
+  if isinstance(item, dict):
+    return (_DICT_FORM, frozenset((key, _hashable_form(value)) for key, value in item.items()))
+  if isinstance(item, list):
+    return (_LIST_FORM, tuple(_hashable_form(value) for value in item))
+
+  hash(item)
+  return item
+
+
 def merge_lists_without_duplicates(*lists, key_path: list | None = None):
   if not lists:
     return []
@@ -154,14 +248,29 @@ def merge_lists_without_duplicates(*lists, key_path: list | None = None):
     key_path = []
 
   merged = []
+  # first position of every item that has a hashable form, by that form
+  positions = {}
+  # positions of items that have none, these are compared one by one
+  unhashable = []
 
   for lst in lists:
     for item in lst:
-      if item in merged:
-        item_path = '->'.join(key_path + [f'[{merged.index(item)}]'])
-        raise MergeError(f'Duplicate item `{item_path}`')
+      try:
+        form = _hashable_form(item)
+      except TypeError:
+        duplicates = [merged.index(item)] if item in merged else []
+        unhashable.append(len(merged))
       else:
-        merged.append(item)
+        duplicates = [position for position in unhashable if merged[position] is item or merged[position] == item]
+        if form in positions:
+          duplicates.append(positions[form])
+        else:
+          positions[form] = len(merged)
+
+      if duplicates:
+        item_path = '->'.join(key_path + [f'[{min(duplicates)}]'])
+        raise MergeError(f'Duplicate item `{item_path}`')
+      merged.append(item)
 
   return merged
 
@@ -191,6 +300,67 @@ def merge_dicts_without_duplicates(*dicts, key_path: list | None = None):
   return merged
 
 
+def merge_top_level_keys(layers: list[dict], merged: Mapping, keys: Iterable) -> dict:
+  '''
+  Shallow copy of `merged`, which is `merge_dicts_with_overrides(*layers)` except for `keys`,
+  with `keys` merged from `layers`. Values of other keys are shared, not copied.
+  '''
+  result = dict(merged)
+  for key in keys:
+    value = merge_dicts_with_overrides(*[{key: layer[key]} for layer in layers if key in layer])
+    if key in value:
+      result[key] = value[key]
+    else:
+      result.pop(key, None)
+
+  return result
+
+
+class LayeredMapping(Mapping):
+  '''
+  Read-only mapping of `own` items over a `shared` mapping without its `hidden` keys. Many of them
+  can share one large mapping while each stores only the items that differ. Mutable values of
+  `shared` are copied on first access, so changing them (e.g. from a template) affects only this mapping.
+  '''
+  __slots__ = ('_own', '_shared', '_hidden', '_len', '_copies')
+
+  def __init__(self, own: dict, shared: Mapping, hidden: Iterable = ()) -> None:
+    self._own = own
+    self._shared = shared
+    self._hidden = frozenset(key for key in hidden if key in shared and key not in own)
+    self._len = len(own) + len(shared) - sum(1 for key in own if key in shared) - len(self._hidden)
+    self._copies = {}
+
+  def __getitem__(self, key: Any) -> Any:
+    if key in self._own:
+      return self._own[key]
+    if key in self._hidden:
+      raise KeyError(key)
+    if key in self._copies:
+      return self._copies[key]
+
+    value = self._shared[key]
+    if isinstance(value, (dict, list, set)):
+      value = self._copies[key] = copy.deepcopy(value)
+
+    return value
+
+  def __contains__(self, key: Any) -> bool:
+    return key in self._own or (key not in self._hidden and key in self._shared)
+
+  def __iter__(self) -> Iterator:
+    yield from self._own
+    for key in self._shared:
+      if key not in self._own and key not in self._hidden:
+        yield key
+
+  def __len__(self) -> int:
+    return self._len
+
+  def __repr__(self) -> str:
+    return f'{type(self).__name__}({dict(self)!r})'
+
+
 def merge_dicts_with_overrides(*dicts):
   if not dicts:
     return {}
@@ -309,21 +479,50 @@ def ensure_list(value: Any, param_name: str) -> list[str]:
   return value
 
 
-def is_match(path: str, patterns: Iterable[str]) -> bool:
-  '''Match by prefix or glob; patterns are posix-like relative paths.'''
-  posix = str(PurePosixPath(path))
-  for pat in patterns:
-    pat_posix = str(PurePosixPath(pat)).rstrip('/')
+def _compile_globs(patterns: list[str]) -> re.Pattern | None:
+  if not patterns:
+    return None
 
+  return re.compile('|'.join(f'(?:{fnmatch.translate(pat)})' for pat in patterns))
+
+
+class PathMatcher:
+  '''
+  Precompiled form of `is_match` for matching many paths against the same patterns.
+  Paths passed to `match` / `matches_subtree` must already be normalized posix paths.
+  '''
+  __slots__ = ('_exact', '_prefixes', '_glob', '_subtree_glob')
+
+  def __init__(self, patterns: Iterable[str]) -> None:
+    patterns = [str(PurePosixPath(pat)).rstrip('/') for pat in patterns]
+
+    self._exact = frozenset(patterns)
+    self._prefixes = tuple(pat + '/' for pat in patterns)
+    self._glob = _compile_globs(patterns)
+    # a glob ending with '*' that matches a path also matches every path below it
+    self._subtree_glob = _compile_globs([pat for pat in patterns if pat.endswith('*')])
+
+  def __bool__(self) -> bool:
+    return bool(self._exact)
+
+  def match(self, path: str) -> bool:
     # prefix match — require a segment boundary after the pattern
-    if posix == pat_posix or posix.startswith(pat_posix + '/'):
+    if path in self._exact or path.startswith(self._prefixes):
       return True
 
-    # glob match
-    if fnmatch.fnmatch(posix, pat_posix):
+    return self._glob is not None and self._glob.match(path) is not None
+
+  def matches_subtree(self, path: str) -> bool:
+    '''True if `path` and everything below it match, i.e. a directory at `path` can be skipped as a whole.'''
+    if path in self._exact or path.startswith(self._prefixes):
       return True
 
-  return False
+    return self._subtree_glob is not None and self._subtree_glob.match(path) is not None
+
+
+def is_match(path: str, patterns: Iterable[str]) -> bool:
+  '''Match by prefix or glob; patterns are posix-like relative paths.'''
+  return PathMatcher(patterns).match(str(PurePosixPath(path)))
 
 
 def is_one_of(path: str, names: Iterable[str]) -> bool:
@@ -1,12 +1,15 @@
 import pytest
+import pickle
 import textwrap
 from unittest.mock import MagicMock
 
 from make_argocd_fly import default
+from make_argocd_fly import config as config_module
 from make_argocd_fly.cliparam import populate_cli_params
 from make_argocd_fly.config import populate_config, get_config, Config, ConfigKeywords
 from make_argocd_fly.exception import ConfigFileError, PathDoesNotExistError, InternalError
-from make_argocd_fly.util import check_lists_equal
+from make_argocd_fly.util import check_lists_equal, VarsResolver
+from make_argocd_fly.renderer import JinjaRenderer
 
 
 
@@ -37,6 +40,86 @@ def test_populate_config__default_values(tmp_path):
   assert config.runtime_output_dir == str(root_dir / f'{default.RUNTIME_DIR_PREFIX}{output_dir}')
   assert config.final_output_dir == str(root_dir / output_dir)
   assert config.tmp_dir == str(root_dir / tmp_dir)
+  assert config.cache_dir is None
+
+def test_populate_config__cache_dir_keeps_config_snapshot(tmp_path):
+  (tmp_path / 'config').mkdir()
+  (tmp_path / 'config' / 'config.yml').write_text('vars: {}')
+  (tmp_path / 'source').mkdir()
+
+  config = populate_config(root_dir=tmp_path, cache_dir='.cache')
+
+  assert config.cache_dir == str(tmp_path / '.cache')
+  assert (tmp_path / '.cache' / default.CONFIG_SNAPSHOT_FILE).exists()
+
+def test_populate_config__cache_dir_reuses_parsed_config_while_unchanged(tmp_path, mocker):
+  (tmp_path / 'config').mkdir()
+  (tmp_path / 'config' / 'config.yml').write_text('vars: {a: 1}')
+  (tmp_path / 'config' / 'envs.yml').write_text('envs: {env1: {}}')
+  (tmp_path / 'source').mkdir()
+  spy = mocker.spy(config_module, '_load_config_file')
+
+  config = populate_config(root_dir=tmp_path, cache_dir='.cache')
+  assert config.config == {'vars': {'a': 1}, 'envs': {'env1': {}}}
+  assert spy.call_count == 2
+
+  config = populate_config(root_dir=tmp_path, cache_dir='.cache')
+  assert config.config == {'vars': {'a': 1}, 'envs': {'env1': {}}}
+  assert spy.call_count == 2
+
+  (tmp_path / 'config' / 'config.yml').write_text('vars: {a: 22}')
+  config = populate_config(root_dir=tmp_path, cache_dir='.cache')
+  assert config.config == {'vars': {'a': 22}, 'envs': {'env1': {}}}
+  assert spy.call_count == 4
+
+def test_populate_config__config_files_parsed_in_processes(tmp_path, monkeypatch):
+  monkeypatch.setattr(default, 'CONFIG_PARSE_PROCESSES_MIN_BYTES', 16)
+  monkeypatch.setattr(config_module.os, 'cpu_count', lambda: 2)
+  (tmp_path / 'config').mkdir()
+  for i in range(4):
+    (tmp_path / 'config' / f'config_{i}.yml').write_text(f'envs: {{env{i}: {{}}}}\nvars: {{var{i}: [{i}]}}')
+  (tmp_path / 'source').mkdir()
+
+  config = populate_config(root_dir=tmp_path)
+  assert list(config.config['envs']) == ['env0', 'env1', 'env2', 'env3']
+  assert config.config['vars'] == {'var0': [0], 'var1': [1], 'var2': [2], 'var3': [3]}
+
+  (tmp_path / 'config' / 'config_1.yml').write_text('vars: {var1: [1]')
+  (tmp_path / 'config' / 'config_2.yml').write_text('vars: {var2: [2]')
+  with pytest.raises(ConfigFileError, match='Invalid YAML in config file `config_1.yml`'):
+    populate_config(root_dir=tmp_path)
+
+  (tmp_path / 'config' / 'config_1.yml').write_text('vars: {var0: 1}')
+  (tmp_path / 'config' / 'config_2.yml').write_text('vars: {var2: [2]}')
+  with pytest.raises(ConfigFileError, match='Duplicate key `vars->var0`'):
+    populate_config(root_dir=tmp_path)
+
+def test_populate_config__small_config_files_parsed_in_process(tmp_path, monkeypatch):
+  monkeypatch.setattr(config_module.os, 'cpu_count', lambda: 2)
+  monkeypatch.setattr(config_module, 'ProcessPoolExecutor', None)
+  (tmp_path / 'config').mkdir()
+  for i in range(64):
+    (tmp_path / 'config' / f'config_{i}.yml').write_text(f'envs: {{env{i}: {{}}}}')
+  (tmp_path / 'source').mkdir()
+
+  config = populate_config(root_dir=tmp_path)
+  assert len(config.config['envs']) == 64
+
+def test_Config__populated_with__populates_other_config_the_same_way(tmp_path, mocker):
+  (tmp_path / 'config').mkdir()
+  (tmp_path / 'config' / 'config.yml').write_text('envs: {env1: {apps: {app1: {}}}}\nvars: {a: 1}')
+  (tmp_path / 'source').mkdir()
+  config = populate_config(root_dir=tmp_path, cache_dir='.cache')
+
+  spy = mocker.spy(config_module, '_load_merged_config')
+  other = Config()
+  other.populate_config(**pickle.loads(pickle.dumps(config.populated_with)))
+
+  spy.assert_not_called()
+  assert other.config == config.config
+  assert other.list_apps('env1') == ['app1']
+  assert (other.source_dir, other.runtime_output_dir, other.final_output_dir, other.tmp_dir, other.cache_dir) == \
+         (config.source_dir, config.runtime_output_dir, config.final_output_dir, config.tmp_dir, config.cache_dir)
 
 def test_populate_config__non_default_values(tmp_path):
   root_dir = tmp_path
@@ -329,6 +412,24 @@ def test_Config__get_app__undefined_app(tmp_path, caplog):
   with pytest.raises(ConfigFileError):
     config.get_app('test_env', 'app3')
 
+def test_Config__get_app__served_from_index_rebuilt_on_populate(tmp_path):
+  config = Config()
+  config.populate_config(config={'envs': {'env1': {'apps': {'app1': {'vars': {'a': 1}}}}, 'env2': {}}})
+
+  assert config.get_app('env1', 'app1') == {'vars': {'a': 1}}
+  assert config.list_apps('env2') == []
+  with pytest.raises(ConfigFileError):
+    config.get_app('env2', 'app1')
+  with pytest.raises(TypeError):
+    config._apps['env1']['app2'] = {}
+
+  config.populate_config(config={'envs': {'env3': {'apps': {'app2': {}}}}})
+
+  assert config.list_envs() == ['env3']
+  assert config.get_app('env3', 'app2') == {}
+  with pytest.raises(ConfigFileError):
+    config.get_env('env1')
+
 ################
 ### Config.list_filtered_envs
 ### Config.list_filtered_apps
@@ -439,6 +540,29 @@ def test_list_filtered_apps__filter_applies_per_env(tmp_path):
   assert config.list_filtered_apps('dev') == ['monitoring/prometheus']
   assert config.list_filtered_apps('staging') == []
 
+def test_list_filtered_apps__glob_character_classes(tmp_path):
+  config = _setup_config(tmp_path, CONFIG, render_apps='[bf]*end,*/[!x]*')
+  assert config.list_filtered_apps('dev') == ['frontend', 'backend', 'monitoring/prometheus']
+
+###################
+### list_filtered_env_apps
+###################
+
+def test_list_filtered_env_apps__no_filter_returns_all_in_config_order(tmp_path):
+  config = _setup_config(tmp_path, CONFIG)
+  assert config.list_filtered_env_apps() == (('dev', 'frontend'), ('dev', 'backend'), ('dev', 'monitoring/prometheus'),
+                                             ('staging', 'frontend'), ('staging', 'backend'),
+                                             ('prod', 'frontend'), ('prod', 'backend'),
+                                             ('production', 'frontend'))
+
+def test_list_filtered_env_apps__env_and_app_filters(tmp_path):
+  config = _setup_config(tmp_path, CONFIG, render_envs='prod*', render_apps='front*')
+  assert config.list_filtered_env_apps() == (('prod', 'frontend'), ('production', 'frontend'))
+  assert config.list_filtered_env_apps() is config.list_filtered_env_apps()
+
+  populate_cli_params(render_envs='dev', render_apps=None, skip_latest_version_check=True)
+  assert config.list_filtered_env_apps() == (('dev', 'frontend'), ('dev', 'backend'), ('dev', 'monitoring/prometheus'))
+
 ##################
 ### Config._get_global_scope
 ##################
@@ -1061,6 +1185,92 @@ def test_Config__get_vars__resolve_var_global_and_env(mocker):
   vars = get_config().get_vars(env_name='test_env', app_name='test_app', extra_vars=extra_vars)
   assert vars == expected_vars
 
+def test_Config__get_vars__global_and_env_layers_resolved_once(mocker):
+  global_vars_return_value = {'var1': 'value_global1', 'var2': '${var1}-x'}
+  env_vars_return_value = {'var3': '${var2}-env'}
+
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value=global_vars_return_value)
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value=env_vars_return_value)
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', side_effect=lambda keyword, env_name, app_name: {'var4': app_name})
+  resolve_all = mocker.spy(VarsResolver, 'resolve_all')
+
+  config = get_config()
+  for app_name in ['app1', 'app2', 'app3']:
+    vars = config.get_vars(env_name='test_env', app_name=app_name, extra_vars={'app_name': app_name})
+    assert vars == {'app_name': app_name,
+                    'var1': 'value_global1',
+                    'var2': 'value_global1-x',
+                    'var3': 'value_global1-x-env',
+                    'var4': app_name}
+
+  # global and env layers once, then app layer and the final pass per app
+  assert resolve_all.call_count == 2 + 3 * 2
+
+def test_Config__get_vars__cached_layers_follow_referenced_extra_vars(mocker):
+  global_vars_return_value = {'var1': '${app_name}-global'}
+  env_vars_return_value = {'var2': '${var1}-${env_name}'}
+  app_vars_return_value = {}
+
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value=global_vars_return_value)
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value=env_vars_return_value)
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', return_value=app_vars_return_value)
+
+  config = get_config()
+  for env_name, app_name in [('env1', 'app1'), ('env1', 'app2'), ('env2', 'app1'), ('env1', 'app1')]:
+    extra_vars = {'env_name': env_name, 'app_name': app_name, 'unused': {'a': app_name}}
+    vars = config.get_vars(env_name=env_name, app_name=app_name, extra_vars=extra_vars)
+    assert vars == {'env_name': env_name,
+                    'app_name': app_name,
+                    'unused': {'a': app_name},
+                    'var1': f'{app_name}-global',
+                    'var2': f'{app_name}-global-{env_name}'}
+
+def test_Config__get_vars__cache_follows_scope_changes(mocker):
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value={'var1': 'value1'})
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value={})
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', return_value={})
+
+  config = get_config()
+  assert config.get_vars(env_name='test_env', app_name='test_app') == {'var1': 'value1'}
+
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value={'var1': 'value2'})
+  assert config.get_vars(env_name='test_env', app_name='test_app') == {'var1': 'value2'}
+
+def test_Config__get_vars__nested_shared_vars_changed_by_one_app_only(mocker):
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value={'cidrs': ['10.0.0.0/8'], 'images': {'app': 'app:1'}})
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value={'labels': {'env': 'test'}})
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', return_value={})
+
+  config = get_config()
+  vars1 = config.get_vars(env_name='test_env', app_name='app1')
+  renderer = JinjaRenderer()
+  renderer.set_template_vars(vars1)
+  renderer.render("{{ cidrs.append('192.168.0.0/16') }}{{ images.update({'app': 'app:2'}) }}")
+  vars1['labels']['env'] = 'changed'
+
+  assert vars1['cidrs'] == ['10.0.0.0/8', '192.168.0.0/16'] and vars1['images'] == {'app': 'app:2'}
+  assert config.get_vars(env_name='test_env', app_name='app2') == {'cidrs': ['10.0.0.0/8'], 'images': {'app': 'app:1'}, 'labels': {'env': 'test'}}
+
+def test_Config__get_vars__apps_share_global_and_env_vars(mocker):
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value={'cidrs': ['10.0.0.0/8'],
+                                                                                 'images': {'app': 'app:1'},
+                                                                                 'url': '${host}/path'})
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value={'images': {'db': 'db:2'}, 'removed': 'x'})
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope',
+               side_effect=lambda keyword, env_name, app_name: {'host': app_name, 'removed': None})
+
+  config = get_config()
+  vars1 = config.get_vars(env_name='test_env', app_name='app1', extra_vars={'images': {'extra': 'extra:3'}})
+  vars2 = config.get_vars(env_name='test_env', app_name='app2')
+
+  assert vars1 == {'cidrs': ['10.0.0.0/8'], 'images': {'extra': 'extra:3', 'app': 'app:1', 'db': 'db:2'}, 'url': 'app1/path', 'host': 'app1'}
+  assert vars2 == {'cidrs': ['10.0.0.0/8'], 'images': {'app': 'app:1', 'db': 'db:2'}, 'url': 'app2/path', 'host': 'app2'}
+  assert 'removed' not in vars1 and len(vars1) == 4
+  assert vars1._shared is vars2._shared
+
+  with pytest.raises(TypeError):
+    vars1['host'] = 'other'
+
 ##################
 ### Config.get_params
 ##################
@@ -1190,3 +1400,37 @@ def test_Config__get_params__random(mocker):
   assert params.parent_app_env is None
   assert check_lists_equal(params.non_k8s_files_to_render, ['env_file1', 'env_file2'])
   assert check_lists_equal(params.exclude_rendering, ['app_exclude1', 'app_exclude2'])
+
+def test_Config__get_params__built_once_per_app_and_read_only(mocker):
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value={'parent_app': 'parent'})
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value={'exclude_rendering': ['env']})
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', return_value={})
+  merge_spy = mocker.spy(config_module, 'merge_dicts_with_overrides')
+
+  config = get_config()
+  params = config.get_params(env_name='test_env', app_name='test_app')
+  assert config.get_params(env_name='test_env', app_name='test_app') is params
+  assert config.get_params(env_name='test_env', app_name='test_app_2') is not params
+  # global and env params are merged once for the env, then once per app
+  assert merge_spy.call_count == 3
+
+  with pytest.raises(InternalError):
+    params.parent_app = 'other'
+
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', return_value={'parent_app': 'env'})
+  assert config.get_params(env_name='test_env', app_name='test_app').parent_app == 'env'
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', return_value={'parent_app': 'app'})
+  assert config.get_params(env_name='test_env', app_name='test_app').parent_app == 'app'
+
+def test_Config__get_params__cache_reused_for_missing_scopes(mocker):
+  global_params = {'parent_app': 'parent'}
+  mocker.patch('make_argocd_fly.config.Config._get_global_scope', return_value=global_params)
+  # scopes missing from the config are new empty dicts on every lookup
+  mocker.patch('make_argocd_fly.config.Config._get_env_scope', side_effect=lambda *args: {})
+  mocker.patch('make_argocd_fly.config.Config._get_app_scope', side_effect=lambda *args: {})
+  merge_spy = mocker.spy(config_module, 'merge_dicts_with_overrides')
+
+  config = get_config()
+  params = config.get_params(env_name='test_env', app_name='test_app')
+  assert config.get_params(env_name='test_env', app_name='test_app') is params
+  assert merge_spy.call_count == 2
@@ -9,6 +9,7 @@ from make_argocd_fly import default
 from make_argocd_fly.context import Context, ctx_set
 from make_argocd_fly.debug_dump import _serialize_debug, StageContextDumper
 from make_argocd_fly.param import Params
+from make_argocd_fly.util import LayeredMapping
 
 
 ###################
@@ -34,6 +35,9 @@ def test__serialize_debug__primitives_and_collections():
   out = _serialize_debug({'a': 1, 'b': {'c': 2}})
   assert out == {'a': 1, 'b': {'c': 2}}
 
+  out = _serialize_debug(LayeredMapping({'a': 1}, {'b': {'c': 2}}))
+  assert out == {'a': 1, 'b': {'c': 2}}
+
 def test__serialize_debug__dataclass_and_fallback():
   dc = _DummyDC(x=1, y=[2, 3])
   assert _serialize_debug(dc) == {'x': 1, 'y': [2, 3]}
@@ -1,5 +1,7 @@
+import copy
+import pickle
 import pytest
-from make_argocd_fly.exception import ConfigFileError
+from make_argocd_fly.exception import ConfigFileError, InternalError
 from make_argocd_fly.param import Params, ApplicationTypes, ApplicationNameFormat
 
 ##################
@@ -119,3 +121,29 @@ def test_Params__populate_params__application_name_with_other_params() -> None:
   )
   assert params.exclude_rendering == ['prod']
   assert params.application_name == ApplicationNameFormat.FULL
+
+##################
+### Params.freeze
+##################
+
+def test_Params__freeze() -> None:
+  params = Params()
+  params.populate_params(parent_app='test_app')
+  assert params.freeze() is params
+
+  with pytest.raises(InternalError):
+    params.parent_app = 'other_app'
+  with pytest.raises(InternalError):
+    params.populate_params(parent_app='other_app')
+  assert params.parent_app == 'test_app'
+
+def test_Params__freeze__copies_stay_frozen() -> None:
+  params = Params()
+  params.populate_params(parent_app='test_app', exclude_rendering=['file1'])
+  params.freeze()
+
+  for params_copy in (copy.deepcopy(params), pickle.loads(pickle.dumps(params))):
+    assert params_copy.parent_app == 'test_app'
+    assert params_copy.exclude_rendering == ['file1']
+    with pytest.raises(InternalError):
+      params_copy.parent_app = 'other_app'
@@ -1,9 +1,14 @@
+import os
+import time
 import pytest
 import jinja2
 import textwrap
+import traceback
+import tracemalloc
 from make_argocd_fly.resource.viewer import build_scoped_viewer
-from make_argocd_fly.renderer import JinjaRenderer
+from make_argocd_fly.renderer import JinjaRenderer, _SharedEnvironment, prune_bytecode_cache
 from make_argocd_fly.exception import UndefinedTemplateVariableError, InternalError, PathDoesNotExistError
+from make_argocd_fly.util import LayeredMapping
 
 ###############
 ### _get_source
@@ -607,3 +612,203 @@ def test_JinjaRenderer__render_with_rawinclude_list(tmp_path):
   '''
 
   assert textwrap.dedent(output) == renderer.render(textwrap.dedent(TEMPLATE))
+
+def test_JinjaRenderer__render_with_include_map__memoized_per_vars(tmp_path, mocker):
+  dir_root = tmp_path / 'dir_root'
+  files = dir_root / 'files'
+  files.mkdir(parents=True)
+  (files / 'file_1.yml.j2').write_text('key_1: {{ content }}')
+
+  renderer = JinjaRenderer()
+  renderer.set_resource_viewer(build_scoped_viewer(str(dir_root)))
+  rendered_spy = mocker.spy(renderer, '_get_rendered')
+
+  app_vars = {'content': 'value 1'}
+  renderer.set_template_vars(app_vars)
+  assert renderer.render("{% include_map 'files' %}") == 'file_1.yml: |\n  key_1: value 1\n'
+  assert renderer.render("a:\n  {% include_map './files' %}") == 'a:\n  file_1.yml: |\n  key_1: value 1\n'
+  assert renderer.render("{% include_list 'files' %}") == '- key_1: value 1\n'
+  assert rendered_spy.call_count == 2
+
+  renderer.set_template_vars({'content': 'value 2'})
+  assert renderer.render("{% include_map 'files' %}") == 'file_1.yml: |\n  key_1: value 2\n'
+  assert rendered_spy.call_count == 3
+
+def test_JinjaRenderer__render_with_rawinclude_map__shared_between_renderers(tmp_path, mocker):
+  dir_root = tmp_path / 'dir_root'
+  (dir_root / 'common').mkdir(parents=True)
+  (dir_root / 'common' / 'file_1.yml').write_text('key_1: value 1')
+  (dir_root / 'app_1').mkdir()
+  (dir_root / 'app_2' / 'sub').mkdir(parents=True)
+
+  viewer = build_scoped_viewer(str(dir_root))
+  renderer_1 = JinjaRenderer()
+  renderer_1.set_resource_viewer(viewer.go_to('app_1'))
+  renderer_2 = JinjaRenderer()
+  renderer_2.set_resource_viewer(viewer.go_to('app_2/sub'))
+  list_spy = mocker.spy(renderer_2, '_list_templates')
+
+  assert renderer_1.render("{% rawinclude_map '../common' %}") == 'file_1.yml: |\n  key_1: value 1\n'
+  assert renderer_2.render("{% rawinclude_map '../../common' %}") == 'file_1.yml: |\n  key_1: value 1\n'
+  list_spy.assert_not_called()
+
+  # another tree of the same directory is read again
+  (dir_root / 'common' / 'file_1.yml').write_text('key_1: changed')
+  other = JinjaRenderer()
+  other.set_resource_viewer(build_scoped_viewer(str(dir_root)).go_to('app_1'))
+  assert other.render("{% rawinclude_map '../common' %}") == 'file_1.yml: |\n  key_1: changed\n'
+
+###########
+### _SharedEnvironment
+###########
+
+def test_JinjaRenderer__shares_environment_and_compiled_templates(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  dir_root.mkdir()
+  (dir_root / 'file.txt').write_text('from dir_root')
+  other_root = tmp_path / 'other_root'
+  other_root.mkdir()
+  (other_root / 'file.txt').write_text('from other_root')
+
+  renderer_1 = JinjaRenderer()
+  renderer_1.set_resource_viewer(build_scoped_viewer(str(dir_root)))
+  renderer_1.set_template_vars({'var': 'value 1'})
+  renderer_2 = JinjaRenderer()
+  renderer_2.set_resource_viewer(build_scoped_viewer(str(other_root)))
+  renderer_2.set_template_vars({'var': 'value 2'})
+
+  TEMPLATE = "{{ var }} {% rawinclude 'file.txt' %}"
+
+  assert renderer_1.env is renderer_2.env
+  assert renderer_1.render(TEMPLATE) == 'value 1 from dir_root'
+  assert renderer_2.render(TEMPLATE) == 'value 2 from other_root'
+
+def test_JinjaRenderer__render__copies_only_shared_vars_read(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  (dir_root / 'files').mkdir(parents=True)
+  (dir_root / 'files' / 'item.j2').write_text('{{ item }}-{{ x }}-{{ names | length }}')
+  shared = {'name': 'app', 'names': [f'name-{i}' for i in range(20000)], 'images': {f'image-{i}': 'latest' for i in range(5000)}}
+
+  renderer = JinjaRenderer()
+  renderer.set_resource_viewer(build_scoped_viewer(str(dir_root)))
+
+  template_vars = LayeredMapping({}, shared)
+  renderer.set_template_vars(template_vars)
+  assert renderer.render('{{ name }}') == 'app'
+  assert template_vars._copies == {}
+  assert renderer.render("{% set x = 2 %}{% for item in [1] %}{% include 'files/item.j2' %}{% endfor %}") == '1-2-20000'
+  assert list(template_vars._copies) == ['names']
+
+  vars_list = [LayeredMapping({'name': f'app{i}'}, shared) for i in range(50)]
+  tracemalloc.start()
+  try:
+    for template_vars in vars_list:
+      renderer.set_template_vars(template_vars)
+      renderer.render('{{ name }}')
+    retained, _ = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  assert retained < 1024 * 1024
+
+def test_JinjaRenderer__render_with_include__same_name_in_other_viewer(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  for app_name in ['app_a', 'app_b']:
+    (dir_root / app_name / 'files').mkdir(parents=True)
+    (dir_root / app_name / 'files' / 'data.yml.j2').write_text(f'from: {app_name}')
+
+  viewer = build_scoped_viewer(str(dir_root))
+  for app_name in ['app_a', 'app_b']:
+    renderer = JinjaRenderer()
+    renderer.set_resource_viewer(viewer.go_to(app_name))
+
+    assert renderer.render("{% include 'files/data.yml.j2' %}") == f'from: {app_name}'
+
+def test_JinjaRenderer__render__error_traceback_names_template_origin():
+  renderer = JinjaRenderer()
+  renderer.set_template_origin('app/deployment.yml.j2')
+
+  with pytest.raises(UndefinedTemplateVariableError) as e:
+    renderer.render('line 1\n{{ undefined_var.attr }}')
+  filenames = [frame.filename for frame in traceback.extract_tb(e.value.__context__.__traceback__)]
+  assert 'app/deployment.yml.j2' in filenames
+
+def test_SharedEnvironment__get_template__cached_by_content():
+  shared = _SharedEnvironment(max_templates=2)
+
+  template_1 = shared.get_template('{{ a }}', 'a.yml.j2')
+  assert shared.get_template('{{ a }}', 'a.yml.j2') is template_1
+  assert shared.get_template('{{ b }}', 'a.yml.j2') is not template_1
+  assert shared.get_template('{{ a }}', 'b.yml.j2').filename == 'b.yml.j2'
+
+def test_SharedEnvironment__get_template__evicts_least_recently_used():
+  shared = _SharedEnvironment(max_templates=2)
+
+  template_a = shared.get_template('{{ a }}', 'a.yml.j2')
+  template_b = shared.get_template('{{ b }}', 'a.yml.j2')
+  shared.get_template('{{ a }}', 'a.yml.j2')
+  shared.get_template('{{ c }}', 'a.yml.j2')
+
+  assert shared.get_template('{{ a }}', 'a.yml.j2') is template_a
+  assert shared.get_template('{{ b }}', 'a.yml.j2') is not template_b
+
+def test_SharedEnvironment__loader_outside_of_render():
+  shared = _SharedEnvironment(max_templates=2)
+
+  with pytest.raises(InternalError):
+    shared.env.loader.get_source(shared.env, 'file.txt')
+
+def test_SharedEnvironment__bytecode_cache__reused_by_other_environment(tmp_path, mocker):
+  TEMPLATE = 'Template {{ var }}'
+
+  shared = _SharedEnvironment(max_templates=2)
+  shared.set_cache_dir(str(tmp_path))
+  shared.get_template(TEMPLATE, 'a.yml.j2')
+
+  assert len(list((tmp_path / 'jinja').iterdir())) == 1
+
+  other = _SharedEnvironment(max_templates=2)
+  other.set_cache_dir(str(tmp_path))
+  compile_spy = mocker.spy(other.env, 'compile')
+
+  assert other.get_template(TEMPLATE, 'a.yml.j2') is not None
+  compile_spy.assert_not_called()
+
+def test_prune_bytecode_cache__removes_buckets_not_used_since(tmp_path, mocker):
+  shared = _SharedEnvironment(max_templates=2)
+  shared.set_cache_dir(str(tmp_path))
+  shared.get_template('{{ a }}', 'a.yml.j2')
+  shared.get_template('{{ b }}', 'b.yml.j2')
+  (tmp_path / 'jinja' / 'other.txt').write_text('')
+  for path in (tmp_path / 'jinja').iterdir():
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+
+  started = time.time()
+  other = _SharedEnvironment(max_templates=2)
+  other.set_cache_dir(str(tmp_path))
+  other.get_template('{{ a }}', 'a.yml.j2')
+  other.get_template('{{ c }}', 'c.yml.j2')
+  prune_bytecode_cache(str(tmp_path), used_since=started)
+
+  assert len([path for path in (tmp_path / 'jinja').iterdir() if path.suffix == '.cache']) == 2
+  assert (tmp_path / 'jinja' / 'other.txt').exists()
+
+  last = _SharedEnvironment(max_templates=2)
+  last.set_cache_dir(str(tmp_path))
+  compile_spy = mocker.spy(last.env, 'compile')
+  last.get_template('{{ a }}', 'a.yml.j2')
+  compile_spy.assert_not_called()
+  last.get_template('{{ b }}', 'b.yml.j2')
+  compile_spy.assert_called_once()
+
+def test_prune_bytecode_cache__without_bytecode_dir(tmp_path):
+  prune_bytecode_cache(str(tmp_path), used_since=time.time())
+
+  assert list(tmp_path.iterdir()) == []
+
+def test_SharedEnvironment__bytecode_cache__disabled_without_cache_dir(tmp_path):
+  shared = _SharedEnvironment(max_templates=2)
+  shared.set_cache_dir(str(tmp_path))
+  shared.set_cache_dir(None)
+  shared.get_template('{{ a }}', 'a.yml.j2')
+
+  assert list((tmp_path / 'jinja').iterdir()) == []
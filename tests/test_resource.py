@@ -1,9 +1,16 @@
 import os
+import re
+import time
+import threading
 import pytest
-from make_argocd_fly.resource.viewer import _get_resource_params, ResourceType, build_scoped_viewer
-from make_argocd_fly.resource.writer import GenericWriter, YamlWriter
+from concurrent.futures import ThreadPoolExecutor
+from make_argocd_fly.resource.viewer import _get_resource_params, _get_entry_params, ResourceType, ResourceViewer, build_scoped_viewer
+from make_argocd_fly.resource.snapshot import Snapshot
+from make_argocd_fly.resource import snapshot as snapshot_module
+from make_argocd_fly.resource import writer as writer_module
+from make_argocd_fly.resource.writer import GenericWriter, YamlWriter, PassthroughWriter
 from make_argocd_fly.exception import InternalError
-from make_argocd_fly.util import check_lists_equal
+from make_argocd_fly.util import check_lists_equal, PathMatcher
 
 ##################
 ### _get_resource_params
@@ -96,6 +103,27 @@ def test_get_resource_type__template_unknown(tmp_path):
   resource_type, template = _get_resource_params(os.path.join(dir_root, file_path))
   assert (resource_type, template) == (ResourceType.UNKNOWN, True)
 
+##################
+### _get_entry_params
+##################
+
+def test_get_entry_params__matches_get_resource_params(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  dir_root.mkdir()
+  (dir_root / 'subdir').mkdir()
+  (dir_root / 'file.yml').write_text('key: value')
+  (dir_root / 'file.yaml.j2').write_text('key: {{ value }}')
+  (dir_root / 'file.txt').write_text('text')
+  (dir_root / 'link_to_subdir').symlink_to(dir_root / 'subdir')
+  (dir_root / 'broken_link.yml').symlink_to(dir_root / 'missing.yml')
+
+  with os.scandir(dir_root) as it:
+    entries = list(it)
+
+  assert len(entries) == 6
+  for entry in entries:
+    assert _get_entry_params(entry) == _get_resource_params(entry.path)
+
 ##################
 ### ScopedViewer
 ##################
@@ -287,6 +315,125 @@ def test_ScopedViewer__with_go_to_to_directories_and_files(tmp_path):
   assert viewer.content == FILE_1_CONTENT
   assert len(list(viewer.iter_children())) == 0
 
+def test_ScopedViewer__children_are_sorted_by_name(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  dir_root.mkdir()
+  for name in ['b.yml', 'c', 'a.yml']:
+    if name == 'c':
+      (dir_root / name).mkdir()
+    else:
+      (dir_root / name).write_text('key: value')
+
+  viewer = build_scoped_viewer(str(dir_root))
+
+  assert [child.name for child in viewer.iter_children()] == ['a.yml', 'b.yml', 'c']
+
+def _tree(viewer):
+  return [(child.rel_path, child.resource_type, child.template, child.content) for child in viewer.search_subresources()]
+
+def test_ScopedViewer__parallel_build_matches_serial_build(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  for app in range(5):
+    for subdir in ['', 'base', 'base/nested']:
+      for idx in range(3):
+        _write(dir_root / f'app_{app}' / subdir / f'file_{idx}.yml.j2', f'key: {app}-{subdir}-{idx}')
+  (dir_root / 'empty').mkdir()
+  _write(dir_root / 'top.txt', 'top')
+
+  serial = build_scoped_viewer(str(dir_root))
+  parallel = build_scoped_viewer(str(dir_root), max_workers=4)
+
+  assert _tree(parallel) == _tree(serial)
+  assert len(_tree(parallel)) == 5 * (3 + 2 + 3 + 1 + 3) + 2
+
+def test_ScopedViewer__empty_scope_with_parallel_build(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  _write(dir_root / 'app' / 'file.yml', 'before')
+
+  viewer = build_scoped_viewer(str(dir_root), max_workers=4, scope=[])
+  _write(dir_root / 'app' / 'file.yml', 'after')
+
+  assert viewer.go_to('app/file.yml').content == 'after'
+
+def test_ScopedViewer__scope_builds_only_selected_subtrees(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  _write(dir_root / 'app_a' / 'file.yml', 'a')
+  _write(dir_root / 'app_b' / 'file.yml', 'b')
+  _write(dir_root / 'group' / 'app_c' / 'file.yml', 'c')
+
+  viewer = build_scoped_viewer(str(dir_root), scope=['app_a', 'group/app_c', 'missing_app'])
+  _write(dir_root / 'app_a' / 'file.yml', 'changed')
+  _write(dir_root / 'app_a' / 'new.yml', 'new')
+  _write(dir_root / 'app_b' / 'new.yml', 'new')
+
+  # selected subtrees are read at build time
+  assert viewer.go_to('app_a/file.yml').content == 'a'
+  assert not viewer.exists('app_a/new.yml')
+  assert viewer.go_to('group/app_c/file.yml').content == 'c'
+
+  # other subtrees are loaded on first access
+  assert viewer.exists('app_b/new.yml')
+  assert _paths(viewer.go_to('app_b').search_subresources()) == ['file.yml', 'new.yml']
+
+def test_ScopedViewer__scope_with_parallel_build(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  _write(dir_root / 'app_a' / 'sub' / 'file.yml', 'a')
+  _write(dir_root / 'app_b' / 'file.yml', 'b')
+
+  viewer = build_scoped_viewer(str(dir_root), max_workers=4, scope=['app_a'])
+
+  assert _tree(viewer) == _tree(build_scoped_viewer(str(dir_root)))
+
+def test_ScopedViewer__scope_lists_directory_once_under_concurrent_access(tmp_path, mocker):
+  dir_root = tmp_path / 'dir_root'
+  _write(dir_root / 'app_a' / 'file.yml', 'a')
+  _write(dir_root / 'app_b' / 'sub' / 'file.yml', 'b')
+
+  viewer = build_scoped_viewer(str(dir_root), scope=['app_a'])
+  barrier = threading.Barrier(8)
+  scandir = ResourceViewer._scandir
+
+  def slow_scandir(node):
+    time.sleep(0.01)
+    return scandir(node)
+
+  scandir_spy = mocker.patch.object(ResourceViewer, '_scandir', autospec=True, side_effect=slow_scandir)
+
+  def search():
+    barrier.wait()
+    return [child._node for child in viewer.go_to('app_b').search_subresources()]
+
+  with ThreadPoolExecutor(max_workers=8) as executor:
+    results = list(executor.map(lambda _: search(), range(8)))
+
+  # app_b and app_b/sub
+  assert scandir_spy.call_count == 2
+  assert all(len(result) == 2 and all(a is b for a, b in zip(result, results[0])) for result in results)
+
+def test_ScopedViewer__empty_scope_reads_content_on_access(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  dir_root.mkdir()
+  file_root_0 = dir_root / 'element.txt'
+  file_root_0.write_text('before')
+
+  viewer = build_scoped_viewer(str(dir_root), scope=[])
+  file_root_0.write_text('after')
+
+  assert viewer.child('element.txt').content == 'after'
+  file_root_0.write_text('changed again')
+  assert viewer.child('element.txt').content == 'after'
+
+def test_ScopedViewer__eager_reads_content_at_build(tmp_path):
+  dir_root = tmp_path / 'dir_root'
+  dir_root.mkdir()
+  file_root_0 = dir_root / 'element.txt'
+  file_root_0.write_text('before')
+
+  viewer = build_scoped_viewer(str(dir_root))
+  file_root_0.write_text('after')
+
+  assert viewer.child('element.txt').content == 'before'
+
 ##################
 ### ResourceViewer.search_subresources()
 ##################
@@ -551,6 +698,51 @@ def test_ResourceViewer__search_subresources__by_depth(tmp_path):
   assert check_lists_equal([(res.name, res.content, res.resource_type, res.template) for res in depth_resources], [])
 
 
+def _search_reference(viewer, resource_types=None, template=None, name_pattern=r'.*', depth=-1):
+  # Plain recursive traversal used as the reference for the indexed search
+  out = []
+  for child in viewer.iter_children():
+    if ((resource_types is None or child.resource_type in resource_types) and
+        (template is None or child.template == template) and
+        re.search(name_pattern, child.name) and
+        (depth == -1 or depth > 0)):
+      out.append(child.rel_path)
+    if child.resource_type == ResourceType.DIRECTORY and (depth == -1 or depth > 0):
+      out.extend(_search_reference(child, resource_types, template, name_pattern, depth - 1 if depth > 0 else -1))
+  return out
+
+def test_ResourceViewer__search_subresources__index_matches_traversal(tmp_path):
+  root = tmp_path / 'src'
+  for subdir in ['', 'base', 'base/nested', 'dev', 'dev/kustomization', 'files']:
+    _write(root / subdir / 'kustomization.yml', 'k: v')
+    _write(root / subdir / 'app.yml.j2', 'k: {{ v }}')
+    _write(root / subdir / 'notes.txt', 'n/a')
+
+  viewer = build_scoped_viewer(str(root))
+
+  for resource_types in [None, [ResourceType.YAML], [ResourceType.DIRECTORY], [ResourceType.UNKNOWN, ResourceType.YAML]]:
+    for template in [None, True, False]:
+      for name_pattern in [r'.*', 'kustomization|Kustomization', r'^base$']:
+        for depth in [-1, 0, 1, 2, 3]:
+          expected = _search_reference(viewer, resource_types, template, name_pattern, depth)
+          found = [c.rel_path for c in viewer.search_subresources(resource_types=resource_types,
+                                                                   template=template,
+                                                                   name_pattern=name_pattern,
+                                                                   depth=depth)]
+          assert found == expected
+
+def test_ResourceViewer__search_subresources__index_subdirs_keep_order(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'app' / 'base' / 'a.yml', 'k: v')
+  _write(root / 'app' / 'dev' / 'b.yml', 'k: v')
+  _write(root / 'common' / 'c.yml', 'k: v')
+
+  viewer = build_scoped_viewer(str(root)).go_to('app', rebase=False)
+
+  children = viewer.search_subresources(resource_types=[ResourceType.YAML],
+                                        search_subdirs=['dev', '../common', 'missing', 'base'])
+  assert [c.rel_path for c in children] == ['app/dev/b.yml', 'common/c.yml', 'app/base/a.yml']
+
 def _paths(children):
   # Helper to extract rel paths in a deterministic order
   return sorted([c.rel_path for c in children])
@@ -610,6 +802,47 @@ def test_ResourceViewer__search_subresources__exclude_by_glob(tmp_path):
 
   assert _paths(children) == ['b/sub/keep.yml']
 
+def test_ResourceViewer__search_subresources__excluded_directory_is_not_descended(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'a' / 'config.yml', 'k: v')
+  _write(root / 'vendor' / 'lib' / 'x.yml', 'k: v')
+  _write(root / 'vendor' / 'y.yml', 'k: v')
+  _write(root / 'z.yml', 'k: v')
+
+  viewer = build_scoped_viewer(str(root))
+  index = viewer._node._get_index()
+
+  ranges = index.prune(PathMatcher(['vendor']), '', -1, 0, len(index.nodes), 0)
+  assert [index.rel_paths[pos] for start, end in ranges for pos in range(start, end)] == ['a', 'a/config.yml', 'z.yml']
+
+  children = viewer.search_subresources(resource_types=[ResourceType.YAML], excludes=['vendor'])
+  assert _paths(children) == ['a/config.yml', 'z.yml']
+
+def test_ResourceViewer__search_subresources__exclude_glob_matching_only_directory(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'a' / 'b' / 'c.yml', 'k: v')
+  _write(root / 'a' / 'd.yml', 'k: v')
+
+  viewer = build_scoped_viewer(str(root))
+
+  # 'a/?' matches the directory 'a/b' itself but not the files below it
+  children = viewer.search_subresources(excludes=['a/?'])
+  assert _paths(children) == ['a', 'a/b/c.yml', 'a/d.yml']
+
+def test_ResourceViewer__search_subresources__exclude_relative_to_scope(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'app' / 'vendor' / 'x.yml', 'k: v')
+  _write(root / 'app' / 'keep.yml', 'k: v')
+  _write(root / 'common' / 'vendor' / 'y.yml', 'k: v')
+  _write(root / 'common' / 'z.yml', 'k: v')
+
+  viewer = build_scoped_viewer(str(root)).go_to('app', rebase=False)
+
+  children = viewer.search_subresources(resource_types=[ResourceType.YAML],
+                                        search_subdirs=['.', '../common'],
+                                        excludes=['app/vendor', 'common/vendor'])
+  assert _paths(children) == ['app/keep.yml', 'common/z.yml']
+
 def test_ResourceViewer__search_subresources__template_true_picks_j2_yaml(tmp_path):
   root = tmp_path / 'src'
   _write(root / 'a' / 'plain.yml', 'k: v')
@@ -758,6 +991,37 @@ def test_GenericWriter__write__multiline(tmp_path):
   assert file.exists()
   assert file.read_text() == content
 
+##################
+### PassthroughWriter
+##################
+
+BINARY_DATA = bytes(range(256)) * 64 + b'\r\n'
+
+def test_PassthroughWriter__write__copies_bytes(tmp_path):
+  src = tmp_path / 'src' / 'logo.png'
+  _write(src)
+  src.write_bytes(BINARY_DATA)
+  dst = tmp_path / 'output' / 'app' / 'logo.png'
+
+  PassthroughWriter().write(output_path=str(dst), data=str(src), env_name='env', app_name='app', origin='logo.png')
+
+  assert dst.read_bytes() == BINARY_DATA
+
+def test_PassthroughWriter__write__falls_back_to_copy(tmp_path, mocker):
+  mocker.patch.object(writer_module, '_clone_file', return_value=False)
+  mocker.patch.object(writer_module, '_copy_file_range', return_value=False)
+  src = tmp_path / 'logo.png'
+  src.write_bytes(BINARY_DATA)
+  dst = tmp_path / 'output' / 'logo.png'
+
+  PassthroughWriter().write(output_path=str(dst), data=str(src), env_name='env', app_name='app', origin='logo.png')
+
+  assert dst.read_bytes() == BINARY_DATA
+
+def test_PassthroughWriter__write__requires_path(tmp_path):
+  with pytest.raises(InternalError):
+    PassthroughWriter().write(output_path=str(tmp_path / 'out'), data=None, env_name='env', app_name='app', origin='logo.png')
+
 ##################
 ### YamlWriter
 ##################
@@ -824,3 +1088,289 @@ def test_YamlWriter__write__non_mapping_raises(tmp_path):
                  env_name='env',
                  app_name='app',
                  origin='/a/b/c')
+
+def test_ScopedViewer__precomputed_rel_path_matches_relpath(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'app' / 'base' / 'a.yml', 'k: v')
+  _write(root / 'app' / 'dev' / 'b.yml', 'k: v')
+  _write(root / 'common' / 'c.yml', 'k: v')
+
+  def expected(v):
+    return os.path.normpath(os.path.relpath(v.path, v._base_path))
+
+  top = build_scoped_viewer(str(root))
+  app = top.go_to('app', rebase=False)
+  views = [top, app, app.go_to('base'), app.go_to('../common', rebase=False), app.child('dev/b.yml'), app.child('..')]
+  views += list(app.iter_children()) + list(top.iter_children())
+  views += list(app.search_subresources(search_subdirs=['.', 'dev', '../common']))
+
+  for view in views:
+    assert view.rel_path == expected(view)
+
+def test_ScopedViewer__rel_path_of_path_leaving_and_reentering_scope(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'app' / 'base' / 'x.yml', 'k: v')
+  _write(root / 'common' / 'c.yml', 'k: v')
+
+  app = build_scoped_viewer(str(root)).go_to('app')
+  assert [child.rel_path for child in app.search_subresources(search_subdirs=['../app/base'])] == ['base/x.yml']
+  assert [child.rel_path for child in app.search_subresources(search_subdirs=['../app/base'], excludes=['base'])] == []
+  assert app.go_to('../app/base', rebase=False).rel_path == 'base'
+  assert app.child('../app/base/x.yml').rel_path == 'base/x.yml'
+  assert app.go_to('../common', rebase=False).rel_path == '../common'
+
+  base = app.go_to('base', rebase=False)
+  assert [child.rel_path for child in base.search_subresources(search_subdirs=['../../app'])] == ['base', 'base/x.yml']
+  assert base.go_to('../../app', rebase=False).rel_path == '.'
+
+def test_ResourceViewer__nodes_are_compact(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'a' / 'kustomization.yml', 'k: v')
+  _write(root / 'b' / 'kustomization.yml', 'k: v')
+
+  viewer = build_scoped_viewer(str(root))
+  a = viewer.go_to('a/kustomization.yml')._node
+  b = viewer.go_to('b/kustomization.yml')._node
+
+  assert not hasattr(a, '__dict__')
+  assert a.name is b.name
+  assert a.path == str(root / 'a' / 'kustomization.yml')
+  assert viewer.go_to('a').go_to('../b/kustomization.yml')._node is b
+
+def test_ScopedViewer__is_binary(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'text.txt', 'plain text')
+  _write(root / 'nul.bin')
+  (root / 'nul.bin').write_bytes(b'abc\0def')
+  _write(root / 'latin1.txt')
+  (root / 'latin1.txt').write_bytes(b'caf\xe9')
+
+  for scope in (None, []):
+    viewer = build_scoped_viewer(str(root), scope=scope)
+
+    assert viewer.go_to('text.txt').is_binary is False
+    assert viewer.go_to('text.txt').content == 'plain text'
+    assert viewer.go_to('nul.bin').is_binary is True
+    assert viewer.go_to('nul.bin').content == ''
+    assert viewer.go_to('latin1.txt').is_binary is True
+    assert viewer.is_binary is False
+
+##################
+### Snapshot
+##################
+
+def _write_old(p, text):
+  # files modified just now are not persisted, see RACY_WINDOW_NS
+  _write(p, text)
+  os.utime(p, ns=(1_000_000_000, 1_000_000_000))
+
+def test_Snapshot__unchanged_files_are_not_read_again(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a.yml', 'a: 1')
+  _write_old(root / 'b' / 'c.yml', 'c: 1')
+  snapshot_path = str(tmp_path / 'cache' / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (0, 2)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (2, 0)
+  assert viewer.go_to('b/c.yml').content == 'c: 1'
+
+def test_Snapshot__changed_file_is_read_again(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a.yml', 'a: 1')
+  _write_old(root / 'b.yml', 'b: 1')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  _write(root / 'a.yml', 'a: 22')
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (1, 1)
+  assert viewer.go_to('a.yml').content == 'a: 22'
+
+def test_Snapshot__recently_modified_file_is_not_persisted(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'a.yml', 'a: 1')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (0, 1)
+
+def test_Snapshot__save_without_prune_keeps_unseen_entries(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a' / 'x.yml', 'x: 1')
+  _write_old(root / 'b' / 'y.yml', 'y: 1')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), scope=['a'], snapshot=snapshot)
+  snapshot.save(prune=False)
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (2, 0)
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), scope=['a'], snapshot=snapshot)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (1, 1)
+
+def test_Snapshot__contents_read_for_looked_up_entries_only(tmp_path, mocker):
+  root = tmp_path / 'src'
+  _write_old(root / 'a' / 'x.yml', 'x: 1')
+  _write_old(root / 'b' / 'y.yml', 'y: 1')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  spy = mocker.spy(snapshot, '_load_content')
+  viewer = build_scoped_viewer(str(root), scope=['a'], snapshot=snapshot)
+  assert spy.call_count == 1
+  assert viewer.go_to('a/x.yml').content == 'x: 1'
+  assert (snapshot.hits, snapshot.misses) == (1, 0)
+
+def test_Snapshot__missing_content_is_read_again(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a.yml', 'a: 1')
+  _write_old(root / 'b.yml', '')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+  for name in os.listdir(snapshot.contents_dir):
+    os.remove(os.path.join(snapshot.contents_dir, name))
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert viewer.go_to('a.yml').content == 'a: 1'
+  assert viewer.go_to('b.yml').content == ''
+  assert (snapshot.hits, snapshot.misses) == (0, 2)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (2, 0)
+
+def test_Snapshot__empty_contents_only(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a.yml', '')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (1, 0)
+  assert viewer.go_to('a.yml').content == ''
+
+def test_Snapshot__save_adds_segment_and_removes_unused_ones(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a' / 'x.yml', 'x: 1')
+  _write_old(root / 'b' / 'y.yml', 'y: 1')
+  _write_old(root / 'b' / 'z.yml', 'z: 1')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+  assert len(os.listdir(snapshot.contents_dir)) == 1
+
+  _write_old(root / 'a' / 'x.yml', 'x: 22')
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), scope=['a'], snapshot=snapshot)
+  snapshot.save(prune=False)
+  assert len(os.listdir(snapshot.contents_dir)) == 2
+
+  (root / 'b' / 'y.yml').unlink()
+  (root / 'b' / 'z.yml').unlink()
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+  assert len(os.listdir(snapshot.contents_dir)) == 1
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (1, 0)
+  assert viewer.go_to('a/x.yml').content == 'x: 22'
+
+def test_Snapshot__save_compacts_segments(tmp_path, monkeypatch):
+  monkeypatch.setattr(snapshot_module, 'SEGMENTS_MAX', 1)
+  root = tmp_path / 'src'
+  _write_old(root / 'a' / 'x.yml', 'x: 1')
+  _write_old(root / 'b' / 'y.yml', 'y: 1')
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  _write_old(root / 'a' / 'x.yml', 'x: 22')
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), scope=['a'], snapshot=snapshot)
+  snapshot.save(prune=False)
+  assert len(os.listdir(snapshot.contents_dir)) == 2
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), scope=['a'], snapshot=snapshot)
+  snapshot.save(prune=False)
+  assert len(os.listdir(snapshot.contents_dir)) == 1
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (2, 0)
+  assert viewer.go_to('a/x.yml').content == 'x: 22'
+  assert viewer.go_to('b/y.yml').content == 'y: 1'
+
+def test_Snapshot__unreadable_snapshot_is_ignored(tmp_path):
+  root = tmp_path / 'src'
+  _write_old(root / 'a.yml', 'a: 1')
+  snapshot_path = tmp_path / 'source.snapshot'
+  snapshot_path.write_bytes(b'not a pickle')
+
+  snapshot = Snapshot.load(str(snapshot_path))
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert viewer.go_to('a.yml').content == 'a: 1'
+  assert (snapshot.hits, snapshot.misses) == (0, 1)
+
+def test_Snapshot__binary_file_is_recorded_without_content(tmp_path):
+  root = tmp_path / 'src'
+  _write(root / 'a.bin')
+  (root / 'a.bin').write_bytes(b'\0' * 10)
+  os.utime(root / 'a.bin', ns=(1_000_000_000, 1_000_000_000))
+  snapshot_path = str(tmp_path / 'source.snapshot')
+
+  snapshot = Snapshot.load(snapshot_path)
+  build_scoped_viewer(str(root), snapshot=snapshot)
+  snapshot.save()
+
+  snapshot = Snapshot.load(snapshot_path)
+  viewer = build_scoped_viewer(str(root), snapshot=snapshot)
+  assert (snapshot.hits, snapshot.misses) == (1, 0)
+  assert viewer.go_to('a.bin').is_binary is True
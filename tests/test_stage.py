@@ -3,23 +3,28 @@ import pytest
 import textwrap
 import yaml
 import os
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from unittest.mock import MagicMock, PropertyMock
 from yaml import SafeLoader
 
 from make_argocd_fly import default
 from make_argocd_fly.stage import (DiscoverK8sAppOfAppsApplication, GenerateNames, _resolve_template_vars,
                                    DiscoverK8sKustomizeApplication, DiscoverK8sSimpleApplication, DiscoverGenericApplication,
-                                   DiscoverK8sHelmfileApplication)
+                                   DiscoverK8sHelmfileApplication, RenderTemplates)
 from make_argocd_fly.stage.discover import _find_child_apps
+from make_argocd_fly.stage import process as process_module
 from make_argocd_fly.context import Context, ctx_set, ctx_get
-from make_argocd_fly.context.data import Resource
+from make_argocd_fly.context.data import Resource, TemplatedResource
 from make_argocd_fly.resource.viewer import ResourceType, build_scoped_viewer
 from make_argocd_fly.config import populate_config
 from make_argocd_fly.util import check_lists_equal
 from make_argocd_fly.type import PipelineType, WriterType
 from make_argocd_fly.param import Params
 from make_argocd_fly.stage.discover import _resolve_kustomize_search_subdirs, _resolve_kustomize_exec_dir
-from make_argocd_fly.exception import InternalError
+from make_argocd_fly.exception import InternalError, TemplateRenderingError
+from make_argocd_fly.limits import RuntimeLimits
 from unittest.mock import patch
 
 
@@ -826,6 +831,27 @@ def test_find_child_apps__multiple_envs_mixed():
   result = _find_child_apps(config, 'bootstrap', 'env1')
   assert check_lists_equal(result, [('env1', 'app_1'), ('env2', 'app_2')])
 
+
+def test_find_child_apps__index_built_once_per_populated_config():
+  config = _make_mock_config({
+    'env1': {
+      'bootstrap': Params(),
+      'app_1': _params_with_parent('bootstrap'),
+    },
+    'env2': {
+      'bootstrap': Params(),
+      'app_2': _params_with_parent('bootstrap'),
+    }
+  })
+  assert _find_child_apps(config, 'bootstrap', 'env1') == [('env1', 'app_1')]
+  assert _find_child_apps(config, 'bootstrap', 'env2') == [('env2', 'app_2')]
+  assert _find_child_apps(config, 'app_1', 'env1') == []
+  assert config.get_params.call_count == 4
+
+  config.config = {}
+  assert _find_child_apps(config, 'bootstrap', 'env1') == [('env1', 'app_1')]
+  assert config.get_params.call_count == 8
+
 ###################
 ### DiscoverK8sAppOfAppsApplication
 ###################
@@ -1138,6 +1164,29 @@ async def test_DiscoverGenericApplication__run__all_file_types_discovered(tmp_pa
   assert 'setup.sh' in origins
 
 
+@pytest.mark.asyncio
+async def test_DiscoverGenericApplication__run__binary_files_are_passed_through(tmp_path, mocker):
+  (tmp_path / 'readme.txt').write_text('some text')
+  (tmp_path / 'logo.png').write_bytes(b'\x89PNG\r\n\x1a\n\0\0\0\rIHDR')
+
+  _patch_config(mocker)
+  _patch_template_vars(mocker)
+
+  viewer = build_scoped_viewer(tmp_path)
+  ctx = _make_simple_ctx('dev', 'my_app')
+  ctx_set(ctx, 'source.viewer', viewer)
+
+  stage = _make_generic_stage()
+  await stage.run(ctx)
+
+  resources = {r.origin: r for r in ctx_get(ctx, stage.provides['resources'])}
+  assert resources['readme.txt'].writer_type == WriterType.GENERIC
+  assert resources['readme.txt'].data == 'some text'
+  assert resources['logo.png'].writer_type == WriterType.PASSTHROUGH
+  assert resources['logo.png'].source_file == str(tmp_path / 'logo.png')
+  assert resources['logo.png'].with_output_path('dev/my_app/logo.png').source_file == str(tmp_path / 'logo.png')
+
+
 @pytest.mark.asyncio
 async def test_DiscoverGenericApplication__run__j2_files_in_templated_resources(tmp_path, mocker):
   (tmp_path / 'cluster.yml.j2').write_text('nodes: {{ node_count }}')
@@ -1538,3 +1587,105 @@ async def test_generatenames_k8s_app_of_apps_behaves_like_k8s_simple(mocker):
   assert len(out) == 1
   assert isinstance(out[0], Resource)
   assert out[0].output_path == 'my_env/my_app/a/application_app.yml'
+
+
+###################
+### RenderTemplates
+###################
+
+def _make_render_ctx(tmp_path, templates: dict[str, str]) -> Context:
+  (tmp_path / 'values.yml').write_text('key: value')
+
+  ctx = _make_simple_ctx('dev', 'my_app')
+  ctx_set(ctx, 'source.viewer', build_scoped_viewer(tmp_path))
+  ctx_set(ctx, 'discovered.templated_resources', [TemplatedResource(resource_type=ResourceType.YAML, vars={'name': 'my_app'},
+                                                                    data=data, origin=origin)
+                                                  for origin, data in templates.items()])
+
+  return ctx
+
+
+def _make_render_stage(executor: ThreadPoolExecutor | None, process_executor: ProcessPoolExecutor | None = None) -> RenderTemplates:
+  limits = RuntimeLimits(app_sem=asyncio.Semaphore(1), subproc_sem=asyncio.Semaphore(1), io_sem=asyncio.Semaphore(1),
+                         render_executor=executor, render_process_executor=process_executor)
+  return RenderTemplates(requires={'viewer': 'source.viewer', 'templated_resources': 'discovered.templated_resources'},
+                         provides={'resources': 'rendered.resources'},
+                         limits=limits)
+
+
+@pytest.mark.asyncio
+async def test_RenderTemplates__run__renders_on_render_executor(tmp_path, mocker):
+  ctx = _make_render_ctx(tmp_path, {'a.yml.j2': "name: {{ name }}\n{% rawinclude 'values.yml' %}"})
+  render_threads = []
+  stage = _make_render_stage(ThreadPoolExecutor(max_workers=1))
+  render = process_module._render_templates
+  mocker.patch.object(process_module, '_render_templates',
+                      side_effect=lambda *args: render_threads.append(threading.current_thread()) or render(*args))
+
+  await stage.run(ctx)
+
+  resources = ctx_get(ctx, 'rendered.resources')
+  assert [(r.origin, r.data) for r in resources] == [('a.yml.j2', 'name: my_app\nkey: value')]
+  assert len(render_threads) == 1 and render_threads[0] is not threading.main_thread()
+
+
+@pytest.mark.asyncio
+async def test_RenderTemplates__run__without_executor_renders_inline(tmp_path):
+  ctx = _make_render_ctx(tmp_path, {'a.yml.j2': 'name: {{ name }}'})
+  stage = _make_render_stage(None)
+
+  await stage.run(ctx)
+
+  assert [r.data for r in ctx_get(ctx, 'rendered.resources')] == ['name: my_app']
+
+
+@pytest.mark.asyncio
+async def test_RenderTemplates__run__error_raised_from_render_executor(tmp_path):
+  ctx = _make_render_ctx(tmp_path, {'a.yml.j2': '{{ undefined_var }}'})
+  stage = _make_render_stage(ThreadPoolExecutor(max_workers=1))
+
+  with pytest.raises(TemplateRenderingError):
+    await stage.run(ctx)
+
+
+def _populate_render_config(tmp_path) -> str:
+  (tmp_path / 'config').mkdir()
+  (tmp_path / 'config' / 'config.yml').write_text('envs:\n  dev:\n    apps:\n      my_app: {}\n')
+  (tmp_path / 'source' / 'my_app').mkdir(parents=True)
+  (tmp_path / 'source' / 'my_app' / 'values.yml').write_text('key: value')
+  populate_config(root_dir=tmp_path, config_dir='config', source_dir='source')
+
+  return str(tmp_path / 'source')
+
+
+def test__render_templates_in_process__viewer_rebuilt_from_path(tmp_path):
+  source_dir = _populate_render_config(tmp_path)
+  templates = [TemplatedResource(resource_type=ResourceType.YAML, vars={}, data="{% rawinclude 'values.yml' %}", origin='a.yml.j2')]
+
+  resources = process_module._render_templates_in_process(os.path.join(source_dir, 'my_app'), templates, 'dev', 'my_app')
+
+  assert [r.data for r in resources] == ['key: value']
+
+
+@pytest.mark.asyncio
+async def test_RenderTemplates__run__renders_in_worker_process(tmp_path):
+  source_dir = _populate_render_config(tmp_path)
+  ctx = _make_simple_ctx('dev', 'my_app')
+  ctx_set(ctx, 'source.viewer', build_scoped_viewer(source_dir).go_to('my_app'))
+  ctx_set(ctx, 'discovered.templated_resources',
+          [TemplatedResource(resource_type=ResourceType.YAML, vars={'name': 'my_app'}, data="name: {{ name }}\n{% rawinclude 'values.yml' %}",
+                             origin='a.yml.j2'),
+           TemplatedResource(resource_type=ResourceType.YAML, vars={}, data='{{ undefined_var }}', origin='b.yml.j2')])
+
+  # forked workers inherit the populated config
+  with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as executor:
+    stage = _make_render_stage(None, executor)
+
+    with pytest.raises(TemplateRenderingError) as e:
+      await stage.run(ctx)
+    assert (e.value.app_name, e.value.env_name) == ('my_app', 'dev')
+
+    ctx_get(ctx, 'discovered.templated_resources').pop()
+    await stage.run(ctx)
+
+  assert [r.data for r in ctx_get(ctx, 'rendered.resources')] == ['name: my_app\nkey: value']
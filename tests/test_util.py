@@ -1,13 +1,31 @@
+import copy
 import logging
+import pickle
 import pytest
 import textwrap
 
 from make_argocd_fly.util import (extract_single_resource, merge_dicts_with_overrides, merge_dicts_without_duplicates, VarsResolver,
-                                  get_module_name, get_package_name, build_path, extract_undefined_variable, is_match,
-                                  copy_dir_hardlinked)
+                                  get_module_name, get_package_name, build_path, extract_undefined_variable, is_match, PathMatcher, find_var_references,
+                                  copy_dir_hardlinked, LayeredMapping, merge_top_level_keys)
 from make_argocd_fly.exception import InternalError, MergeError, ConfigFileError, PathDoesNotExistError
 
 
+###################
+### find_var_references
+###################
+
+def test_find_var_references__nested():
+  value = {
+    'a': '${var1}',
+    'b': ['${var2.key} and ${var3[0]}', {'c': 'prefix-${var4}-suffix'}],
+    'd': 'no references $var5 {var6}',
+    'e': 42,
+  }
+  assert find_var_references(value) == {'var1', 'var2', 'var3', 'var4'}
+
+def test_find_var_references__custom_identifier():
+  assert find_var_references({'a': '%{var1} ${var2}'}, var_identifier='%') == {'var1'}
+
 ###################
 ### extract_single_resource
 ###################
@@ -292,6 +310,68 @@ def test_merge_dicts_without_duplicates__with_list_of_dicts_extend_complex_dupli
   with pytest.raises(MergeError):
     merge_dicts_without_duplicates(dict1, dict2)
 
+def test_merge_dicts_without_duplicates__with_list_duplicate_position():
+  dict1 = {'b': ['x', {'y': [1, 2], 'z': 3}, [4]]}
+  dict2 = {'b': ['w', {'z': 3, 'y': [1, 2]}]}
+
+  with pytest.raises(MergeError, match=r'Duplicate item `b->\[1\]`'):
+    merge_dicts_without_duplicates(dict1, dict2)
+
+def test_merge_dicts_without_duplicates__with_list_items_compared_by_equality():
+  with pytest.raises(MergeError, match=r'Duplicate item `b->\[1\]`'):
+    merge_dicts_without_duplicates({'b': ['1', 1]}, {'b': [1.0]})
+
+  result = merge_dicts_without_duplicates({'b': [[1], {'x': [1]}]}, {'b': [(1,), {'x': (1,)}]})
+  assert result == {'b': [[1], {'x': [1]}, (1,), {'x': (1,)}]}
+
+def test_merge_dicts_without_duplicates__with_list_of_unhashable_items():
+  dict1 = {'b': [{1}, 2, {'x': {3}}]}
+  dict2 = {'b': [frozenset({1})]}
+
+  with pytest.raises(MergeError, match=r'Duplicate item `b->\[0\]`'):
+    merge_dicts_without_duplicates(dict1, dict2)
+  with pytest.raises(MergeError, match=r'Duplicate item `b->\[2\]`'):
+    merge_dicts_without_duplicates(dict1, {'b': [{'x': {3}}]})
+
+###############
+### merge_top_level_keys
+###############
+
+def test_merge_top_level_keys():
+  layers = [{'a': {'x': 1}, 'b': 1}, {'a': {'y': 2}, 'c': {'z': 3}}, {'b': None, 'd': 4}]
+  merged = merge_dicts_with_overrides(*layers[:2])
+
+  result = merge_top_level_keys(layers, merged, ['b', 'd'])
+  assert result == merge_dicts_with_overrides(*layers)
+  assert result['c'] is merged['c']
+
+###############
+### LayeredMapping
+###############
+
+def test_LayeredMapping():
+  shared = {'a': 1, 'b': {'x': 2}, 'c': 3}
+  mapping = LayeredMapping({'a': 10, 'd': 4}, shared, hidden={'c', 'missing'})
+
+  assert mapping == {'a': 10, 'b': {'x': 2}, 'd': 4}
+  assert list(mapping) == ['a', 'd', 'b']
+  assert len(mapping) == 3
+  assert 'c' not in mapping and mapping.get('c') is None
+  with pytest.raises(KeyError):
+    mapping['c']
+  with pytest.raises(TypeError):
+    mapping['a'] = 1
+
+  assert copy.deepcopy(mapping) == mapping
+  assert pickle.loads(pickle.dumps(mapping)) == mapping
+  assert dict(**mapping) == {'a': 10, 'b': {'x': 2}, 'd': 4}
+
+  # shared mutable values are copied once per mapping
+  assert mapping['b'] is not shared['b'] and mapping['b'] is mapping['b']
+  mapping['b']['x'] = 20
+  assert shared['b'] == {'x': 2}
+  assert LayeredMapping({}, shared)['b'] == {'x': 2}
+
 ###############
 ### merge_dicts_with_overrides
 ###############
@@ -612,6 +692,39 @@ def test_vars_resolver_var_from_different_source():
   assert result == {'var1': 'value2'}
   assert resolver.get_resolutions() == 1
 
+def test_vars_resolver__resolve_all__nested_vars_in_concatenation_and_dict():
+  vars = {'var1': 'a-${var2}-b', 'var2': '${var3}', 'var3': '1.10', 'var4': '${var5}', 'var5': {'key': '${var3}'}}
+  result = VarsResolver.resolve_all(vars, vars)
+  assert result == {'var1': 'a-1.10-b', 'var2': 1.1, 'var3': '1.10', 'var4': {'key': 1.1}, 'var5': {'key': 1.1}}
+
+def test_vars_resolver__resolve_all__results_do_not_share_objects():
+  vars = {'var1': '${var3}', 'var2': '${var3}', 'var3': {'key': 'value'}}
+  result = VarsResolver.resolve_all(vars, vars)
+  result['var1']['key'] = 'changed'
+  assert result['var2'] == {'key': 'value'}
+  assert vars['var3'] == {'key': 'value'}
+
+def test_vars_resolver__resolve_all__self_reference_to_other_key_is_not_a_cycle():
+  vars = {'app': {'name': 'foo', 'image': '${app[name]}:latest'}}
+  result = VarsResolver.resolve_all(vars, vars)
+  assert result == {'app': {'name': 'foo', 'image': 'foo:latest'}}
+
+def test_vars_resolver__resolve_all__cycle():
+  vars = {'var1': '${var2}', 'var2': 'x-${var3}', 'var3': '${var1}'}
+  with pytest.raises(ConfigFileError, match=r'Circular variable reference: \$\{var2\} -> \$\{var3\} -> \$\{var1\} -> \$\{var2\}'):
+    VarsResolver.resolve_all(vars, vars)
+
+def test_vars_resolver__resolve_all__self_cycle_with_allow_unresolved():
+  vars = {'var1': '${var1}-suffix'}
+  with pytest.raises(ConfigFileError, match='Circular variable reference'):
+    VarsResolver.resolve_all(vars, vars, allow_unresolved=True)
+
+def test_vars_resolver__resolve_all__allow_unresolved():
+  vars = {'var1': '${var2}', 'var2': 'x-${var3}'}
+  assert VarsResolver.resolve_all(vars, vars, allow_unresolved=True) == {'var1': 'x-${var3}', 'var2': 'x-${var3}'}
+  with pytest.raises(ConfigFileError):
+    VarsResolver.resolve_all(vars, vars)
+
 ################
 ### get_module_name
 ################
@@ -784,6 +897,34 @@ def test_is_match__root_level_file_not_excluded_by_env_pattern():
   # a file at root level whose name starts with an env name should not be excluded
   assert is_match('production.yaml', ['prod']) == False
 
+################
+### PathMatcher
+################
+
+def test_PathMatcher__empty_is_falsy():
+  assert not PathMatcher([])
+  assert PathMatcher(['prod'])
+
+def test_PathMatcher__match_same_as_is_match():
+  patterns = ['prod/', 'staging', '*.txt', 'b/**/secret*', 'a/?']
+  for path in ['prod', 'prod/foo.yaml', 'production/foo.yaml', 'staging/x/y.yml', 'notes.txt',
+               'b/sub/secret.yml', 'b/secret.yml', 'a/b', 'a/b/c.yml', 'a/bc']:
+    assert PathMatcher(patterns).match(path) == is_match(path, patterns)
+
+def test_PathMatcher__matches_subtree__prefix():
+  assert PathMatcher(['vendor']).matches_subtree('vendor') == True
+  assert PathMatcher(['vendor']).matches_subtree('vendor/lib') == True
+  assert PathMatcher(['vendor']).matches_subtree('vendored') == False
+
+def test_PathMatcher__matches_subtree__glob_with_trailing_star():
+  assert PathMatcher(['b/**/secret*']).matches_subtree('b/sub/secrets') == True
+
+def test_PathMatcher__matches_subtree__glob_without_trailing_star():
+  # 'a/?' matches the directory 'a/b' but not 'a/b/c.yml' below it
+  matcher = PathMatcher(['a/?'])
+  assert matcher.match('a/b') == True
+  assert matcher.matches_subtree('a/b') == False
+
 ################
 ### copy_dir_hardlinked
 ################